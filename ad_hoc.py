@@ -1,18 +1,229 @@
+from collections import defaultdict
+import copy
+import json
 import logging
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import math
 import networkx as nx
+import numpy as np
+import os
 import random
 
+import instrumentation
+import routing
+
 logging.basicConfig(level=logging.ERROR, format="%(message)s")
 
-class RandomAdHocNetwork(nx.DiGraph):
+class _NodeNames(object):
+    """
+    The names of a network's split nodes by index, "n in" at 2 * n and
+    "n out" at 2 * n + 1, worked out on access rather than stored
+    """
+
+    def __init__(self, node_count):
+        self.node_count = node_count
+
+    def __len__(self):
+        return 2 * self.node_count
+
+    def __getitem__(self, v):
+        if isinstance(v, slice):
+            return [self[u] for u in xrange(*v.indices(len(self)))]
+        if v < 0:
+            v += len(self)
+        if not 0 <= v < len(self):
+            raise IndexError(v)
+        return "{} {}".format(v >> 1, "out" if v & 1 else "in")
+
+    def __iter__(self):
+        for v in xrange(len(self)):
+            yield self[v]
+
+
+class _NodeIndex(object):
+    """
+    The index of each split node name, the inverse of _NodeNames
+    """
+
+    def __init__(self, node_count):
+        self.node_count = node_count
+
+    def __getitem__(self, node):
+        try:
+            n, kind = node.split(" ")
+            n = int(n)
+        except (AttributeError, ValueError):
+            raise KeyError(node)
+        if kind not in ("in", "out") or not 0 <= n < self.node_count or \
+                str(n) != node.split(" ")[0]:
+            raise KeyError(node)
+        return 2 * n + (kind == "out")
+
+    def __contains__(self, node):
+        try:
+            self[node]
+        except KeyError:
+            return False
+        return True
+
+
+class _NodeView(object):
+    """
+    Read-only, networkx-style access to node attributes by name
+    """
+
+    def __init__(self, net):
+        self.net = net
+
+    def __getitem__(self, node):
+        net = self.net
+        v = net.index[node]
+        n = v >> 1
+        info = {"id": n, "x": net.x[n].item(), "y": net.y[n].item()}
+        if v & 1:
+            info["type"] = "out"
+            info["energy"] = net.energy[n].item()
+        else:
+            info["type"] = "in"
+        return info
+
+    def __contains__(self, node):
+        return node in self.net.index
+
+
+class _AdjacencyView(object):
+    """
+    The live outgoing edges of a single node, keyed by destination name
+    """
+
+    def __init__(self, net, v):
+        self.net = net
+        self.v = v
+
+    def _edges(self):
+        net = self.net
+        lo, hi = net.indptr[self.v], net.indptr[self.v + 1]
+        return [e for e in xrange(lo, hi) if net.alive[e]]
+
+    def __getitem__(self, dest):
+        return _EdgeView(self.net, self.net._edge(self.v, self.net.index[dest]))
+
+    def __contains__(self, dest):
+        return self.net.has_edge(self.net.names[self.v], dest)
+
+    def __iter__(self):
+        names = self.net.names
+        dst = self.net.dst
+        return iter([names[dst[e]] for e in self._edges()])
+
+    def __len__(self):
+        return len(self._edges())
+
+
+class _EdgeView(object):
+    """
+    Attribute access for a single edge, backed by the edge arrays
+    """
+
+    def __init__(self, net, e):
+        self.net = net
+        self.e = e
+
+    def __getitem__(self, key):
+        if key == "type":
+            return "external" if self.net.external[self.e] else "internal"
+        return self.net.edge_data[key][self.e].item()
+
+    def __setitem__(self, key, value):
+        edge_data = self.net.edge_data
+        if key not in edge_data:
+            # Missing edge attributes default to 1, as in networkx
+            edge_data[key] = np.ones(len(self.net.dst))
+        edge_data[key][self.e] = value
+
+    def __repr__(self):
+        info = dict((key, values[self.e].item())
+                    for key, values in self.net.edge_data.items())
+        info["type"] = self["type"]
+        return repr(info)
+
+
+class NetworkOverlay(object):
+    """
+    A RandomAdHocNetwork with its external edges pruned at threshold, as
+    prune_edges(threshold) would, without copying or modifying it. The
+    pruning is applied lazily while searching, and attributes not defined
+    here are read from the underlying network.
+    """
+
+    def __init__(self, net, threshold=None):
+        self.net = net
+        self.threshold = threshold
+
+    def __getattr__(self, name):
+        return getattr(self.net, name)
+
+    def live(self, edges):
+        net = self.net
+        live = net.alive[edges]
+        if self.threshold is not None:
+            threshold = np.maximum(self.threshold, net.edge_data["cost"][edges])
+            live = live & ~(net.external[edges] &
+                            (net.energy[net.src[edges] >> 1] < threshold))
+        return live
+
+    live.vectorized = True
+
+    def shortest_path(self, src, dest, weight="cost"):
+        return self.net.shortest_path(src, dest, weight=weight, live=self.live)
+
+
+class RandomAdHocNetwork(object):
+    """
+    Random ad hoc network where every node n is split into an "n in" node
+    and an "n out" node joined by an internal edge.
+
+    Nodes are stored by integer index (2 * n for "n in", 2 * n + 1 for
+    "n out") with coordinates and energies held in NumPy arrays, and edges
+    are stored as CSR arrays grouped by source node. The string node names
+    and the networkx-style net[src][dest] / net.node[name] lookups are thin
+    views over these arrays.
+    """
     figure_counter = 0
 
+    # Search engine for shortest paths, "python" or "csgraph"; see
+    # shortest_paths()
+    backend = "python"
+
+    # Set of split nodes that searches with backend "python" add every
+    # node they settle to, when not None; see parallel.py
+    reads = None
+
+    # What save() writes: topology arrays that never change after
+    # construction, which load() memory-maps and shares, arrays that each
+    # loaded network gets a private copy of, and scalar parameters
+    shared_arrays = ("x", "y", "src", "dst", "external", "indptr",
+                     "edge_keys", "by_cost", "sorted_cost", "cost_indptr")
+    shared_edge_data = ("distance", "cost")
+    private_arrays = ("energy", "alive", "live_count")
+    parameters = ("node_count", "width", "height", "transmission_range",
+                  "min_energy", "max_energy", "packet_size",
+                  "number_of_requests", "x_offset", "y_offset", "connected",
+                  "components", "attempts")
+
     def __init__(self, node_count=100, width=1000, height=1000,
                  transmission_range=200, min_energy=5000000000, max_energy=5000000000,
-                 packet_size=512, seed=None, number_of_requests=10):
-        super(RandomAdHocNetwork, self).__init__()
+                 packet_size=512, seed=None, number_of_requests=10,
+                 max_attempts=1):
+        """
+        With max_attempts above 1, node positions are drawn again until
+        the topology is connected or max_attempts have been made; attempts
+        records how many were. The draws continue from seed, so the result
+        is still reproducible.
+        """
         random.seed(seed)
         self.node_count = node_count
         self.width = width
@@ -25,8 +236,11 @@ class RandomAdHocNetwork(nx.DiGraph):
         self.x_offset = self.width / 40
         self.y_offset = self.height / 40
         self.requests = []
-        self._generate_random_nodes()
-        self._calculate_neighbors()
+        for self.attempts in xrange(1, max(max_attempts, 1) + 1):
+            self._generate_random_nodes()
+            self._calculate_neighbors()
+            if self.components == 1:
+                break
         self._generate_requests()
 
         if not self.is_connected():
@@ -35,25 +249,207 @@ class RandomAdHocNetwork(nx.DiGraph):
         else:
             self.connected = True
 
+    @property
+    def node(self):
+        return _NodeView(self)
+
+    def __getitem__(self, node):
+        return _AdjacencyView(self, self.index[node])
+
+    def nodes(self):
+        return list(self.names)
+
+    def edges(self):
+        names = self.names
+        return [(names[self.src[e]], names[self.dst[e]])
+                for e in np.flatnonzero(self.alive)]
+
+    def number_of_edges(self):
+        return int(np.count_nonzero(self.alive))
+
+    def _edge(self, v, u):
+        lo, hi = self.indptr[v], self.indptr[v + 1]
+        e = lo + np.searchsorted(self.dst[lo:hi], u)
+        if e == hi or self.dst[e] != u or not self.alive[e]:
+            raise KeyError(self.names[u])
+        return e
+
+    def has_edge(self, src, dest):
+        try:
+            self._edge(self.index[src], self.index[dest])
+        except KeyError:
+            return False
+        return True
+
+    def remove_edge(self, src, dest):
+        self.alive[self._edge(self.index[src], self.index[dest])] = False
+
+    @instrumentation.timed("copy")
+    def copy(self):
+        # Topology arrays are never modified after construction and are
+        # shared; only the energy, edge liveness and edge data are copied
+        net = copy.copy(self)
+        net.energy = self.energy.copy()
+        net.alive = self.alive.copy()
+        net.live_count = self.live_count.copy()
+        net.dirty = set(self.dirty)
+        net.edge_data = dict(
+            (key, values if key in self.shared_edge_data else values.copy())
+            for key, values in self.edge_data.items())
+        net.requests = list(self.requests)
+        return net
+
+    def save(self, path):
+        """
+        Write the network to the directory path as .npy arrays plus a JSON
+        file of parameters, in a form load() can memory-map
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in self.shared_arrays + self.private_arrays:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+        for key, values in self.edge_data.items():
+            np.save(os.path.join(path, "edge_" + key + ".npy"), values)
+        info = dict((name, getattr(self, name)) for name in self.parameters)
+        info["requests"] = self.requests
+        info["dirty"] = sorted(self.dirty)
+        info["edge_data"] = sorted(self.edge_data)
+        with open(os.path.join(path, "network.json"), "w") as f:
+            json.dump(info, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Attach to a network written by save() or tiled.generate(). The
+        topology arrays are memory-mapped read-only, so every process that
+        loads the same path shares them, and only energies, edge liveness
+        and edge weights are read into private arrays. Node names are
+        worked out on access, and the coordinate lookups are built the
+        first time they are used.
+        """
+        def array(name, shared):
+            values = np.load(os.path.join(path, name + ".npy"),
+                             mmap_mode="r")
+            return values if shared else np.array(values)
+
+        with open(os.path.join(path, "network.json")) as f:
+            info = json.load(f)
+        net = cls.__new__(cls)
+        for name in cls.parameters:
+            setattr(net, name, info[name])
+        for name in cls.shared_arrays:
+            setattr(net, name, array(name, True))
+        for name in cls.private_arrays:
+            setattr(net, name, array(name, False))
+        net.edge_data = dict(
+            (str(key), array("edge_" + key, key in cls.shared_edge_data))
+            for key in info["edge_data"])
+        net.requests = [tuple(str(node) for node in request)
+                        for request in info["requests"]]
+        net.dirty = set(info["dirty"])
+        net.names = _NodeNames(net.node_count)
+        net.index = _NodeIndex(net.node_count)
+        return net
+
+    def __getattr__(self, name):
+        # Only called for missing attributes: the coordinate lookups of a
+        # loaded network and the expansion order, built on first use
+        if name in ("coords", "grid", "cell_size"):
+            self.coords = dict(((x, y), n) for n, (x, y) in
+                               enumerate(zip(self.x.tolist(), self.y.tolist())))
+            self._build_grid()
+            return getattr(self, name)
+        if name == "expansion_order":
+            self.expansion_order = self._expansion_order()
+            return self.expansion_order
+        raise AttributeError(name)
+
+    def _expansion_order(self):
+        # Positions of each node's edges in the order the networkx version
+        # searched them: that of its Python 2 adjacency dict, filled in
+        # name order and then copied for routing. Keeps ties between
+        # equally short paths, which MECBE metrics often have, broken the
+        # same way.
+        order = np.zeros(len(self.dst), dtype=np.int32)
+        indptr = self.indptr.tolist()
+        dst = self.dst.tolist()
+        for v in xrange(len(indptr) - 1):
+            lo, hi = indptr[v], indptr[v + 1]
+            if hi - lo < 2:
+                continue
+            adjacency = dict(sorted(
+                (self.names[u], i) for i, u in enumerate(dst[lo:hi])))
+            copied = {}
+            for name, i in adjacency.iteritems():
+                copied[name] = i
+            order[lo:hi] = copied.values()
+        order.setflags(write=False)
+        return order
+
+    def state(self):
+        """
+        The arrays routing changes, relative to the topology: energies,
+        the removed edges, and the edges whose weight differs from their
+        cost with those weights. Much smaller than save() for large
+        networks, since no topology array is included.
+        """
+        weight = self.edge_data["weight"]
+        changed = np.flatnonzero(weight != self.edge_data["cost"])
+        return {
+            "edge_count": np.array(len(self.dst)),
+            "energy": self.energy,
+            "removed": np.flatnonzero(~self.alive).astype(np.int32),
+            "live_count": self.live_count,
+            "dirty": np.array(sorted(self.dirty), dtype=np.int32),
+            "weight_edges": changed.astype(np.int32),
+            "weights": weight[changed],
+        }
+
+    def restore(self, state):
+        """
+        Return to a state() taken from a network with the same topology
+        """
+        if int(state["edge_count"]) != len(self.dst):
+            raise ValueError("State is for a network with {} edges, not {}"
+                             .format(int(state["edge_count"]), len(self.dst)))
+        self.energy[:] = state["energy"]
+        self.alive[:] = True
+        self.alive[state["removed"]] = False
+        self.live_count[:] = state["live_count"]
+        self.dirty = set(state["dirty"].tolist())
+        weight = self.edge_data["cost"].copy()
+        weight[state["weight_edges"]] = state["weights"]
+        self.edge_data["weight"] = weight
+
     def depleted_nodes(self):
-        depleted_node_count = 0
-        for node in self.nodes():
-            if self.node[node]["type"] == "out":
-                if len(self[node]) == 0:
-                    depleted_node_count += 1
-        return depleted_node_count
+        # Pruning keeps the live edges of each node a prefix of its edges
+        # by cost, so a node is depleted once that prefix is empty, or if
+        # remove_edge() removed every edge in it
+        live = np.flatnonzero(self.live_count)
+        first = self.alive[self.by_cost[self.cost_indptr[live]]]
+        depleted = self.node_count - len(live)
+        for n in live[~first].tolist():
+            lo = self.cost_indptr[n]
+            if not self.alive[self.by_cost[lo:lo + self.live_count[n]]].any():
+                depleted += 1
+        return depleted
 
     @staticmethod
     def _formatted_name(node):
-        node_info = node.split()
-        node_name, node_type = node_info
-        if node_type == "in":
-            return "{name} {info} ".format(name=node_name, info=node_type)
+        if node.endswith(" in"):
+            return node + " "
         else:
-            return "{name} {info}".format(name=node_name, info=node_type)
+            return node
 
     def residual_energy(self, src, dest):
-        return self.node[src]["energy"] - self.cost(src, dest)
+        return self.get_energy(src) - self.cost(src, dest)
+
+    def edge_residual_energy(self, edges, costs):
+        """
+        Energy left at the source of each of edges, an index array or
+        slice, after sending one packet at the given costs
+        """
+        return self.energy[self.src[edges] >> 1] - costs
 
     def set_weight(self, src, dest, value):
         self[src][dest]["weight"] = value
@@ -62,34 +458,48 @@ class RandomAdHocNetwork(nx.DiGraph):
         return self[src][dest]["weight"]
 
     def get_energy(self, node):
-        return self.node[node]["energy"]
+        return self.energy[self.index[node] >> 1].item()
 
     def set_energy(self, node, energy):
-        self.node[node]["energy"] = energy
+        n = self.index[node] >> 1
+        self.energy[n] = energy
+        self.dirty.add(n)
+
+    def path_edges(self, path):
+        """
+        Indices of the live edges along a path of node names
+        """
+        nodes = np.array([self.index[node] for node in path], dtype=np.int64)
+        keys = nodes[:-1] * len(self.names) + nodes[1:]
+        edges = np.searchsorted(self.edge_keys, keys)
+        edges = np.minimum(edges, len(self.edge_keys) - 1)
+        missing = (self.edge_keys[edges] != keys) | ~self.alive[edges]
+        if missing.any():
+            i = np.flatnonzero(missing)[0]
+            raise KeyError("No edge from {} to {}".format(path[i], path[i + 1]))
+        return edges
 
     def min_residual_energy(self, path):
-        min_src = None
-        min_dest = None
-        min_value = None
-        for index, value in enumerate(path[:-1]):
-            src = path[index]
-            dest = path[index + 1]
-            if self[src][dest]["type"] == "external":
-                value = self.residual_energy(src, dest)
-                if not min_src or value < min_value:
-                    min_src = src
-                    min_dest = dest
-                    min_value = value
+        edges = self.path_edges(path)
+        edges = edges[self.external[edges]]
+        residual = self.edge_residual_energy(edges,
+                                             self.edge_data["cost"][edges])
+        i = np.argmin(residual)
+        min_src = self.names[self.src[edges[i]]]
+        min_dest = self.names[self.dst[edges[i]]]
+        min_value = residual[i].item()
         if min_value < 0:
             print path
             print min_src, min_dest, min_value
-            print "Energy", self.node[min_src]["energy"]
+            print "Energy", self.get_energy(min_src)
             print "Cost", self.cost(min_src, min_dest)
             raise Exception
         return ((min_src, min_dest), min_value)
 
     def external_edges(self):
-        return filter(lambda s: self[s[0]][s[1]]["type"] == "external", self.edges())
+        names = self.names
+        return [(names[self.src[e]], names[self.dst[e]])
+                for e in np.flatnonzero(self.alive & self.external)]
 
     def _generate_request(self):
         src, dest = random.sample(range(self.node_count), 2)
@@ -116,6 +526,11 @@ class RandomAdHocNetwork(nx.DiGraph):
         xcoord = None
         ycoord = None
         self.coords = dict()
+        self.x = np.empty(self.node_count)
+        self.y = np.empty(self.node_count)
+        self.energy = np.empty(self.node_count)
+        self.names = []
+        self.index = dict()
         xcoord, ycoord = self._get_random_node()
         for n in xrange(self.node_count):
             while (xcoord, ycoord) in self.coords:
@@ -125,44 +540,228 @@ class RandomAdHocNetwork(nx.DiGraph):
             out_node = "{} out".format(n)
             initial_energy = random.uniform(self.min_energy,
                                             self.max_energy)
-            self.add_node(in_node, id=n, type="in", x=xcoord, y=ycoord)
-            self.add_node(out_node, id=n, type="out", x=xcoord,
-                          y=ycoord, energy=initial_energy)
-
-    def shortest_path(self, src, dest, weight="cost"):
-        return nx.shortest_path(self, src, dest, weight=weight)
+            self.x[n] = xcoord
+            self.y[n] = ycoord
+            self.energy[n] = initial_energy
+            self._add_names(in_node, out_node)
+
+    def _add_names(self, in_node, out_node):
+        self.index[in_node] = len(self.names)
+        self.names.append(in_node)
+        self.index[out_node] = len(self.names)
+        self.names.append(out_node)
+
+    def _weights(self, weight):
+        if callable(weight):
+            return weight
+        weights = self.edge_data.get(weight)
+        if weights is None:
+            weights = np.ones(len(self.dst))
+        return weights
+
+    def _path_to(self, pred, target):
+        # pred is a dict from _dijkstra, or a row of predecessors from
+        # routing.csgraph_dijkstra
+        path = []
+        v = target
+        while v is not None and v != routing.NO_PREDECESSOR:
+            path.append(self.names[v])
+            v = pred[v]
+        path.reverse()
+        return path
+
+    def node_weight(self, values):
+        """
+        Weight function giving each external edge the value of its source
+        node in values, indexed by node id, and each internal edge 0
+        """
+        def weight(edges):
+            return np.where(self.external[edges],
+                            values[self.src[edges] >> 1], 0)
+        weight.vectorized = True
+        return weight
+
+    @instrumentation.timed("shortest_path")
+    def shortest_paths(self, queries, weight="cost", live=None):
+        """
+        Shortest paths and their lengths for a batch of (src, dest)
+        queries, as dicts keyed by query that leave out unreachable ones.
+
+        weight is the name of an edge attribute, or a function from a
+        slice of the edges leaving one node to their weights such as
+        node_weight() returns. live, if given, is a function from such a
+        slice to the mask of edges that may be used, in place of the
+        network's own live edges.
+
+        With backend "python", queries from the same source share one
+        Dijkstra run, which only evaluates weight and live for the nodes
+        it settles, and ties are broken as the networkx version broke
+        them. With backend "csgraph", the whole batch is a single
+        scipy.sparse.csgraph call after weight and live are evaluated for
+        every edge; ties between equally short paths may then be broken
+        differently.
+        """
+        by_source = {}
+        for src, dest in queries:
+            by_source.setdefault(self.index[src], {})[self.index[dest]] = (src, dest)
+        weights = self._weights(weight)
+        paths = {}
+        lengths = {}
+        if self.backend == "csgraph":
+            sources = sorted(by_source)
+            dist, pred = routing.csgraph_dijkstra(
+                self.indptr, self.dst, sources, weights,
+                self.alive if live is None else live)
+            for row, source in enumerate(sources):
+                reached = dist[row]
+                for target, query in by_source[source].items():
+                    if np.isfinite(reached[target]):
+                        paths[query] = self._path_to(pred[row].tolist(), target)
+                        lengths[query] = reached[target]
+            return paths, lengths
+        for source, targets in by_source.items():
+            dist, pred = routing.dijkstra(
+                self.indptr, self.dst, source, targets, weights,
+                self.alive if live is None else live, self.expansion_order)
+            if self.reads is not None:
+                self.reads.update(dist)
+            for target, query in targets.items():
+                if target in dist:
+                    paths[query] = self._path_to(pred, target)
+                    lengths[query] = dist[target]
+        return paths, lengths
+
+    def shortest_paths_from(self, src, targets, weight="cost", live=None):
+        """
+        Shortest paths and their lengths from src to each of targets,
+        found with a single search, as dicts by target. Unreachable
+        targets are left out.
+        """
+        paths, lengths = self.shortest_paths(
+            [(src, dest) for dest in targets], weight, live)
+        return (dict((dest, path) for (_, dest), path in paths.items()),
+                dict((dest, length) for (_, dest), length in lengths.items()))
+
+    def shortest_path(self, src, dest, weight="cost", live=None):
+        paths, lengths = self.shortest_paths_from(src, [dest], weight, live)
+        if dest not in paths:
+            raise nx.NetworkXNoPath(
+                "node {} not reachable from {}".format(dest, src))
+        return paths[dest]
 
     def shortest_path_length(self, src, dest, weight="cost"):
-        return nx.shortest_path_length(self, src, dest, weight=weight)
+        paths, lengths = self.shortest_paths_from(src, [dest], weight)
+        if dest not in lengths:
+            raise nx.NetworkXNoPath(
+                "node {} not reachable from {}".format(dest, src))
+        return lengths[dest]
 
     def _get_random_node(self):
         return (random.randint(0, self.width), random.randint(0,
                                                               self.height))
 
-    def update_along_path(self, path):
-        total_energy = 0
-        for index, value in enumerate(path[:-1]):
-            src = path[index]
-            dest = path[index + 1]
-            if self[src][dest]["type"] == "external":
-                total_energy += self.cost(src, dest)
-                self.set_energy(
-                    src, self.get_energy(src) - self.cost(src, dest))
-        return total_energy
+    def drain(self, energy):
+        """
+        Use up energy at every node, as idle consumption over time
+        """
+        if energy <= 0:
+            return
+        np.subtract(self.energy, energy, out=self.energy)
+        np.maximum(self.energy, 0, out=self.energy)
+        self.dirty.update(xrange(self.node_count))
 
+    def packets_along_path(self, path):
+        """
+        How many packets can be sent along path before a node on it has
+        less energy left than the cost of its edge, so that prune_edges()
+        would remove that edge. Each packet costs every node the cost of
+        its edge on the path.
+        """
+        edges = self.path_edges(path)
+        edges = edges[self.external[edges]]
+        if not len(edges):
+            return float("inf")
+        energy = self.energy[self.src[edges] >> 1]
+        costs = self.edge_data["cost"][edges]
+        # The k-th packet is sent while the node still has the cost of
+        # its edge left after paying for the k - 1 before it
+        packets = np.floor(energy / costs)
+        packets = np.where(energy - (packets - 1) * costs < costs,
+                           packets - 1, packets)
+        return max(int(packets.min()), 0)
+
+    @instrumentation.timed("update_along_path")
+    def update_along_path(self, path, packets=1):
+        edges = self.path_edges(path)
+        edges = edges[self.external[edges]]
+        instrumentation.count("energy_updates", len(edges))
+        costs = self.edge_data["cost"][edges] * packets
+        nodes = self.src[edges] >> 1
+        np.subtract.at(self.energy, nodes, costs)
+        self.dirty.update(nodes.tolist())
+        return sum(costs.tolist())
+
+    @instrumentation.timed("prune_edges")
     def prune_edges(self, threshold=None):
-        for src, dest in self.external_edges():
-            edge = self[src][dest]
-            if threshold is None:
-                edge_threshold = self.cost(src, dest)
-            else:
-                edge_threshold = max(threshold, self.cost(src, dest))
-            if self.node[src]["energy"] < edge_threshold:
+        """
+        Remove the external edges whose source node has less energy than
+        the cost of the edge, or than threshold if that is larger.
+
+        Only nodes whose energy changed since the last call are checked
+        against edge costs, and since each node's edges are sorted by cost
+        the edges it can no longer afford are a suffix of its list.
+        Returns the indices of the removed edges.
+        """
+        pruned = []
+        instrumentation.count("prune_nodes_checked", len(self.dirty))
+        if threshold is not None:
+            starved = np.flatnonzero((self.energy < threshold) &
+                                     (self.live_count > 0))
+            pruned.append(self._cut(
+                starved, np.zeros(len(starved), dtype=np.int64), threshold))
+        dirty = np.sort(np.fromiter(self.dirty, dtype=np.int64,
+                                    count=len(self.dirty)))
+        # Only nodes that can no longer afford their most expensive live
+        # edge lose any edges
+        count = self.live_count[dirty]
+        dirty = dirty[count > 0]
+        count = count[count > 0]
+        short = (self.sorted_cost[self.cost_indptr[dirty] + count - 1] >
+                 self.energy[dirty])
+        for n in dirty[short].tolist():
+            lo = self.cost_indptr[n]
+            count = self.live_count[n]
+            keep = np.searchsorted(self.sorted_cost[lo:lo + count],
+                                   self.energy[n], side="right")
+            if keep < count:
+                pruned.append(self._cut(
+                    np.array([n]), np.array([keep]), threshold))
+        self.dirty.clear()
+        return np.concatenate(pruned) if pruned else np.array([], dtype=np.int64)
+
+    def _cut(self, nodes, keep, threshold=None):
+        """
+        Remove all but the keep cheapest live edges of each node in nodes
+        """
+        starts = self.cost_indptr[nodes] + keep
+        lengths = self.live_count[nodes] - keep
+        total = lengths.sum()
+        if total == 0:
+            return np.array([], dtype=np.int64)
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        pruned = self.by_cost[offsets + np.arange(total)]
+        instrumentation.counters["edges_touched"] += total
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            cost = self.edge_data["cost"]
+            for e in pruned:
+                src, dest = self.names[self.src[e]], self.names[self.dst[e]]
                 logging.debug("Node -> {} :: Energy -> {} :: Threshold -> {} ".format(
-                    src, self.node[src]["energy"], edge_threshold))
+                    src, self.energy[self.src[e] >> 1], max(threshold, cost[e])))
                 logging.debug(
-                    "Removing edge {} -> {} : {}".format(src, dest, edge))
-                self.remove_edge(src, dest)
+                    "Removing edge {} -> {} : {}".format(src, dest, _EdgeView(self, e)))
+        self.alive[pruned] = False
+        self.live_count[nodes] = keep
+        return pruned
 
     def cost(self, src, dest):
         try:
@@ -186,19 +785,105 @@ class RandomAdHocNetwork(nx.DiGraph):
             raise KeyError(
                 "No weight set for edge from {} to {}".format(src, dest))
 
+    def _build_grid(self):
+        # Uniform grid with cells the size of the transmission range, so
+        # every neighbor of a node lies in its own or an adjacent cell
+        self.cell_size = max(self.transmission_range, 1)
+        self.grid = defaultdict(list)
+        for (x, y), n in self.coords.items():
+            self.grid[self._cell(x, y)].append(n)
+
+    def _cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def neighbors_within(self, x, y, r):
+        """
+        Return the sorted ids of all nodes within distance r of (x, y)
+        """
+        cx, cy = self._cell(x, y)
+        reach = int(math.ceil(float(r) / self.cell_size))
+        neighbors = []
+        for i in xrange(cx - reach, cx + reach + 1):
+            for j in xrange(cy - reach, cy + reach + 1):
+                for n in self.grid.get((i, j), ()):
+                    dx = self.x[n] - x
+                    dy = self.y[n] - y
+                    if math.sqrt((dx * dx) + (dy * dy)) <= r:
+                        neighbors.append(n)
+        return sorted(neighbors)
+
     def _calculate_neighbors(self):
-        for out_node in self.out_nodes():
-            for in_node in self.in_nodes():
-                distance = self.distance_between(out_node, in_node)
-                cost = self._calculate_energy_cost(distance)
-                if (distance <= self.transmission_range and
-                        (in_node.split()[0] != out_node.split()[0])):
-                    self.add_edge(out_node, in_node, distance=distance,
-                                  weight=cost, cost=cost, type="external")
-        for in_node in self.in_nodes():
-            out_node = in_node.split()[0] + " out"
-            self.add_edge(in_node, out_node, distance=0, weight=0,
-                          cost=0, type="internal")
+        # Each "n in" node has a single internal edge to "n out", and each
+        # "n out" node has an external edge to "m in" for every node m in
+        # range. Edges are grouped by source and sorted by destination.
+        # Nodes in range are merged in a union-find as edges are added, so
+        # the number of connected components is known once they are built.
+        self._build_grid()
+        src = []
+        dst = []
+        distance = []
+        external = []
+        parent = range(self.node_count)
+        components = self.node_count
+
+        def find(n):
+            while parent[n] != n:
+                parent[n] = parent[parent[n]]
+                n = parent[n]
+            return n
+
+        for n in xrange(self.node_count):
+            src.append(2 * n)
+            dst.append(2 * n + 1)
+            distance.append(0)
+            external.append(False)
+            for m in self.neighbors_within(self.x[n], self.y[n],
+                                           self.transmission_range):
+                if m != n:
+                    src.append(2 * n + 1)
+                    dst.append(2 * m)
+                    distance.append(self.distance_between(
+                        self.names[2 * n + 1], self.names[2 * m]))
+                    external.append(True)
+                    if m > n:
+                        a, b = find(n), find(m)
+                        if a != b:
+                            parent[a] = b
+                            components -= 1
+        self.components = components
+        self.src = np.array(src, dtype=np.int32)
+        self.dst = np.array(dst, dtype=np.int32)
+        self.external = np.array(external, dtype=bool)
+        self.alive = np.ones(len(dst), dtype=bool)
+        self.indptr = np.searchsorted(
+            self.src, np.arange(2 * self.node_count + 1)).astype(np.int32)
+        # Edges are sorted by (src, dst), so these keys are sorted too
+        self.edge_keys = (self.src.astype(np.int64) * len(self.names) +
+                          self.dst)
+        distance = np.array(distance, dtype=float)
+        cost = np.where(self.external,
+                        self._calculate_energy_cost(distance), 0)
+        self.edge_data = {
+            "distance": distance,
+            "cost": cost,
+            "weight": cost.copy(),
+        }
+        # External edges of each node sorted by cost, with live_count[n]
+        # of node n's edges still live. Energy only ever decreases, so
+        # pruning only ever shortens this prefix.
+        edges = np.flatnonzero(self.external)
+        self.by_cost = edges[np.lexsort((cost[edges], self.src[edges]))]
+        self.sorted_cost = cost[self.by_cost]
+        self.cost_indptr = np.searchsorted(
+            self.src[self.by_cost] >> 1, np.arange(self.node_count + 1))
+        self.live_count = np.diff(self.cost_indptr)
+        self.dirty = set(xrange(self.node_count))
+        # The topology never changes from here on, and copy() shares it, so
+        # writing to it would change every copy; make such writes fail
+        for name in self.shared_arrays:
+            getattr(self, name).setflags(write=False)
+        for key in self.shared_edge_data:
+            self.edge_data[key].setflags(write=False)
 
     def distance_between(self, src, dest):
         x1 = self.node[src]["x"]
@@ -209,10 +894,10 @@ class RandomAdHocNetwork(nx.DiGraph):
         return distance
 
     def in_nodes(self):
-        return sorted(filter(lambda n: " in" in n, self.nodes()))
+        return sorted(self.names[0::2])
 
     def out_nodes(self):
-        return sorted(filter(lambda n: " out" in n, self.nodes()))
+        return sorted(self.names[1::2])
 
     def get_by_coords(self, x, y, node_type=None):
         node_id = self.coords[(x, y)]
@@ -236,42 +921,83 @@ class RandomAdHocNetwork(nx.DiGraph):
 
     def is_connected(self):
         """
-        Build temporary graph structure to check for connectivity
-        since NetworkX can only check for connectivity on undirected graphs
-        """
-        temp = nx.Graph()
-        for e in self.edges():
-            src = e[0].split()[0]
-            dest = e[1].split()[0]
-            temp.add_edge(src, dest)
-        return nx.is_connected(temp)
-
-    def draw(self, output_file=None, requests=None):
-        plt.figure(random.randint(0, 1000000))
-        colors = {
-            "out": "c",
-            "in": "m",
-        }
-        for n in self.nodes():
-            node = self.node[n]
-            plt.scatter(node["x"], node["y"])
-            plt.scatter(node["x"] + self.x_offset, node["y"] + self.y_offset)
-        for e in self.edges():
-            src, dest = e
-            edge_type = self.node[src]["type"]
-            color = colors[edge_type]
-            plt.plot([self.node[src]["x"], self.node[dest]["x"] +
-                      self.x_offset], [self.node[src]["y"], self.node[dest]["y"]
-                                       + self.y_offset], color=color)
+        Whether every physical node can reach every other over the live
+        edges, followed in either direction. Until an edge is removed this
+        is the union-find result from construction; after that it is a
+        breadth-first search. Pruning removes edges in one direction only,
+        so the search follows live edges both ways.
+        """
+        if self.node_count == 0:
+            return False
+        if self.alive.all():
+            return self.components == 1
+        live = self.alive & self.external
+        neighbors = defaultdict(list)
+        for v, u in zip((self.src[live] >> 1).tolist(),
+                        (self.dst[live] >> 1).tolist()):
+            neighbors[v].append(u)
+            neighbors[u].append(v)
+        seen = set([0])
+        frontier = [0]
+        while frontier:
+            n = frontier.pop()
+            for m in neighbors[n]:
+                if m not in seen:
+                    seen.add(m)
+                    frontier.append(m)
+        return len(seen) == self.node_count
+
+    def _segments(self, src, dst):
+        # Lines from each source node to its destination node, which is
+        # drawn offset so edges in both directions can be told apart
+        nodes_from = src >> 1
+        nodes_to = dst >> 1
+        return np.stack([
+            np.column_stack([self.x[nodes_from], self.y[nodes_from]]),
+            np.column_stack([self.x[nodes_to] + self.x_offset,
+                             self.y[nodes_to] + self.y_offset]),
+        ], axis=1)
+
+    def draw(self, output_file=None, requests=None, max_edges=None,
+             rasterized=False, dpi=None):
+        """
+        Plot the nodes, the live edges and the requests, with one
+        collection per kind of node and edge.
+
+        With output_file, the plot is drawn on its own Agg figure, so no
+        display is needed and worker processes can save plots; the format
+        follows the file extension, e.g. ".png" for a raster image.
+        rasterized renders the nodes and edges as an image even in vector
+        formats, and max_edges draws an evenly spaced subset of at most
+        that many edges of each kind.
+        """
+        if output_file:
+            figure = Figure()
+            FigureCanvasAgg(figure)
+        else:
+            figure = plt.figure()
+        axes = figure.add_subplot(111)
+        axes.scatter(self.x, self.y, rasterized=rasterized)
+        axes.scatter(self.x + self.x_offset, self.y + self.y_offset,
+                     rasterized=rasterized)
+        # Internal "n in" -> "n out" edges and external edges
+        live = np.flatnonzero(self.alive)
+        for external, color in ((False, "m"), (True, "c")):
+            edges = live[self.external[live] == external]
+            if max_edges is not None and len(edges) > max_edges:
+                edges = edges[np.linspace(0, len(edges) - 1,
+                                          max_edges).astype(int)]
+            axes.add_collection(LineCollection(
+                self._segments(self.src[edges], self.dst[edges]),
+                colors=color, rasterized=rasterized))
         if requests:
-            for r in requests:
-                src, dest = r
-                color = "g"
-                plt.plot([self.node[src]["x"], self.node[dest]["x"] +
-                          self.x_offset], [self.node[src]["y"], self.node[dest]["y"]
-                                           + self.y_offset], color=color)
+            ends = np.array([(self.index[src], self.index[dest])
+                             for src, dest in requests])
+            axes.add_collection(LineCollection(
+                self._segments(ends[:, 0], ends[:, 1]), colors="g"))
+        axes.autoscale_view()
 
         if output_file:
-            plt.savefig(output_file)
+            figure.savefig(output_file, dpi=dpi)
         else:
             plt.show()
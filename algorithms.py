@@ -0,0 +1,8 @@
+"""
+The routing algorithms by name, in the order results are reported
+"""
+from gdp import GDP
+from mecbe import MECBE
+from oml import OML
+
+ALGORITHMS = [("OML", OML), ("MECBE", MECBE), ("GDP", GDP)]
@@ -1,6 +1,8 @@
+from ad_hoc import RandomAdHocNetwork
 from oml import OML
 from mecbe import MECBE
 from gdp import GDP
+from results import PrintReporter
 
 config = {
             "node_count": 100,
@@ -12,8 +14,8 @@ config = {
             "packet_size": 512,
             "number_of_requests": 20,
             "seed": 0,
-            "output_path": False,
 }
+output_path = False
 
 plot_info = "{requests}-requests".format(requests=config["number_of_requests"])
 
@@ -27,9 +29,12 @@ config["max_energy"] *= 1000000000
 # 1 byte = 8 bits
 config["packet_size"] *= 8
 
-oml = OML(**config)
-mecbe = MECBE(**config)
-gdp = GDP(**config)
+# Build the topology once and give each algorithm its own copy
+net = RandomAdHocNetwork(**config)
+reporters = [PrintReporter(output_path=output_path)]
+oml = OML(net=net, reporters=reporters)
+mecbe = MECBE(net=net, reporters=reporters)
+gdp = GDP(net=net, reporters=reporters)
 
 print "**************************************************************************************"
 print "Running OML"
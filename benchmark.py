@@ -0,0 +1,190 @@
+from multiprocessing import Pool
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import time
+
+import numpy as np
+
+import instrumentation
+from ad_hoc import RandomAdHocNetwork
+from algorithms import ALGORITHMS
+
+scales = {
+    "quick": {
+        "node_count": [100, 1000],
+        "number_of_requests": [20, 100],
+    },
+    "full": {
+        "node_count": [100, 1000, 5000, 10000, 50000],
+        "number_of_requests": [20, 100, 1000, 10000],
+    },
+}
+
+
+def network_kwargs(node_count, number_of_requests, seed):
+    # The field grows with the node count so that node density stays that
+    # of 100 nodes on 1000 x 1000, with a range that keeps it connected
+    side = int(round(1000 * math.sqrt(node_count / 100.0)))
+    return {
+        "node_count": node_count,
+        "width": side,
+        "height": side,
+        "transmission_range": 250,
+        "min_energy": 0.04 * 1000000000,
+        "max_energy": 0.04 * 1000000000,
+        "packet_size": 512 * 8,
+        "number_of_requests": number_of_requests,
+        "seed": seed,
+    }
+
+
+def _record(benchmark, node_count, number_of_requests, seed, seconds):
+    return {
+        "benchmark": benchmark,
+        "node_count": node_count,
+        "number_of_requests": number_of_requests,
+        "seed": seed,
+        "seconds": seconds,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "dijkstra_calls": instrumentation.counters["dijkstra_calls"],
+        "edges_touched": instrumentation.counters["edges_touched"],
+    }
+
+
+def bench_topology(case):
+    """
+    Time construction, is_connected and a full prune_edges of one topology.
+    is_connected() answers from the components counted during
+    construction until an edge is removed, so it is timed on a copy with
+    one edge removed, which takes the breadth-first search.
+    """
+    node_count, seed = case
+    records = []
+
+    instrumentation.reset_counters()
+    start = time.time()
+    net = RandomAdHocNetwork(**network_kwargs(node_count, 0, seed))
+    records.append(_record("construct", node_count, 0, seed,
+                           time.time() - start))
+
+    probe = net.copy()
+    edge = np.flatnonzero(probe.external)[0]
+    probe.remove_edge(probe.names[probe.src[edge]], probe.names[probe.dst[edge]])
+    instrumentation.reset_counters()
+    start = time.time()
+    probe.is_connected()
+    records.append(_record("is_connected", node_count, 0, seed,
+                           time.time() - start))
+
+    # A new network has every node marked as changed, so this checks them all
+    instrumentation.reset_counters()
+    start = time.time()
+    net.prune_edges()
+    records.append(_record("prune_edges", node_count, 0, seed,
+                           time.time() - start))
+    return records
+
+
+def bench_routing(case):
+    """
+    Time a full run of one algorithm, excluding topology construction
+    """
+    name, node_count, number_of_requests, seed, backend = case
+    net = RandomAdHocNetwork(
+        **network_kwargs(node_count, number_of_requests, seed))
+    net.backend = backend
+    algorithm = dict(ALGORITHMS)[name](net=net)
+    instrumentation.reset_counters()
+    start = time.time()
+    results = algorithm.run()
+    seconds = time.time() - start
+    record = _record("route_" + name, node_count, number_of_requests, seed,
+                     seconds)
+    record["backend"] = backend
+    record["connected"] = net.connected
+    record["satisfied_requests"] = len(results)
+    record["per_request"] = seconds / max(len(results), 1)
+    return [record]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(scale, seeds, output_file, algorithms=None, backend="python"):
+    """
+    Run every benchmark case at the given scale, one after another, each
+    in a fresh process so that peak RSS is measured per case
+    """
+    names = algorithms or [name for name, _ in ALGORITHMS]
+    cases = [(bench_topology, (node_count, seed))
+             for node_count in scale["node_count"] for seed in seeds]
+    cases += [(bench_routing,
+               (name, node_count, number_of_requests, seed, backend))
+              for node_count in scale["node_count"]
+              for number_of_requests in scale["number_of_requests"]
+              for name in names for seed in seeds]
+    commit = _commit()
+    pool = Pool(1, maxtasksperchild=1)
+    try:
+        with open(output_file, "w") as output:
+            for function, case in cases:
+                for record in pool.apply(function, (case,)):
+                    record["commit"] = commit
+                    output.write(json.dumps(record, sort_keys=True) + "\n")
+                    output.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def compare(base_file, new_file):
+    """
+    Print how the time of each case in new_file compares to base_file.
+    Routing cases are only compared with cases run on the same backend.
+    """
+    def load(path):
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return dict(((r["benchmark"], r["node_count"],
+                      r["number_of_requests"], r["seed"],
+                      r.get("backend")), r)
+                    for r in records)
+
+    base = load(base_file)
+    new = load(new_file)
+    for key in sorted(set(base) & set(new)):
+        old_seconds = base[key]["seconds"]
+        new_seconds = new[key]["seconds"]
+        ratio = old_seconds / new_seconds if new_seconds else float("inf")
+        print "{:<16} {:>7} nodes {:>6} requests seed {} {}: {:.4f}s -> {:.4f}s ({:.2f}x)".format(
+            key[0], key[1], key[2], key[3], key[4] or "-", old_seconds,
+            new_seconds, ratio)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark topology construction and routing")
+    parser.add_argument("--scale", choices=sorted(scales), default="quick")
+    parser.add_argument("--seeds", type=int, default=1)
+    parser.add_argument("--algorithms", nargs="*")
+    parser.add_argument("--backend", choices=["python", "csgraph"],
+                        default="python")
+    parser.add_argument("--output", default="benchmark.jsonl")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        benchmark(scales[args.scale], range(args.seeds), args.output,
+                  args.algorithms, args.backend)
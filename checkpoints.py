@@ -0,0 +1,56 @@
+"""
+Checkpoints of an algorithm's run, written as a single compressed .npz
+file: the routing network's state() plus the algorithm's request lists
+and the results routed so far as JSON.
+"""
+import json
+import os
+
+import numpy as np
+
+from results import RequestResult
+
+
+def save(path, algorithm, results):
+    """
+    Write a checkpoint of algorithm's run so far to path. The file is
+    replaced atomically, so a run killed while writing leaves the previous
+    checkpoint intact.
+    """
+    state = {
+        "all_requests": algorithm.all_requests,
+        "remaining_requests": algorithm.remaining_requests,
+        "results": [result.to_dict() for result in results],
+    }
+    arrays = algorithm.routing_net.state()
+    arrays["algorithm"] = np.array(json.dumps(state))
+    partial = path + ".partial"
+    with open(partial, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.rename(partial, path)
+
+
+def restore(path, algorithm, results):
+    """
+    Load a checkpoint written by save() into algorithm, which must have
+    been started on a network with the same topology, and add the results
+    routed before it to results without reporting them again
+    """
+    data = np.load(path)
+    try:
+        state = json.loads(str(data["algorithm"]))
+        algorithm.routing_net.restore(
+            dict((name, data[name]) for name in data.files
+                 if name != "algorithm"))
+    finally:
+        data.close()
+    algorithm.all_requests = [tuple(str(node) for node in request)
+                              for request in state["all_requests"]]
+    algorithm.remaining_requests = [tuple(str(node) for node in request)
+                                    for request in state["remaining_requests"]]
+    for record in state["results"]:
+        result = RequestResult.from_dict(record)
+        results.requests.append(result)
+        algorithm.satisfied_requests.append(result.request)
+        algorithm.request_solutions.append(
+            (result.request, result.path, result.energy))
@@ -0,0 +1,50 @@
+from networkx.exception import NetworkXNoPath
+import time
+
+from results import RequestResult
+
+
+def send(net, find_path, packets, sent_along=None):
+    """
+    Send a flow of packets along the paths find_path() returns. Each path
+    is charged in bulk for as many packets as it can carry before a node
+    on it would lose its edge to pruning, and only then is the next path
+    found. sent_along(path, packets), if given, is called before each
+    charge, so that if it fails no energy has been charged for the path.
+
+    Returns the (path, packets, energy) segments the flow was sent along.
+    Raises NetworkXNoPath if there is no path for the first packet; if a
+    later path cannot be found, the segments sent so far are returned.
+    """
+    segments = []
+    while packets > 0:
+        try:
+            path = find_path()
+        except NetworkXNoPath:
+            if not segments:
+                raise
+            break
+        # A path always carries at least one packet, as a single request
+        # always has
+        if packets == 1:
+            count = 1
+        else:
+            count = max(min(packets, net.packets_along_path(path)), 1)
+        if sent_along is not None:
+            sent_along(path, count)
+        energy = net.update_along_path(path, count)
+        segments.append((path, count, energy))
+        packets -= count
+    return segments
+
+
+def request_result(request, segments, packets, start, net):
+    """
+    RequestResult for a request sent as the given segments, with the
+    segments only recorded for a flow of more than one packet
+    """
+    energy = sum(segment_energy for _, _, segment_energy in segments)
+    delivered = sum(count for _, count, _ in segments)
+    return RequestResult(request, segments[0][0], energy, time.time() - start,
+                         net.depleted_nodes(), delivered,
+                         segments if packets != 1 else None)
@@ -1,67 +1,228 @@
+from heapq import heapify, heappop, heapreplace
 from networkx.exception import NetworkXNoPath
+import numpy as np
+import time
+import checkpoints
+import flows
+import instrumentation
 from ad_hoc import RandomAdHocNetwork
+from path_cache import PathCache
+from results import PrintReporter, RequestResult, Results
 
 class GDP(object):
-    def __init__(self, output_path = False, **kwargs):
-        self.net = RandomAdHocNetwork(**kwargs)
-        self.output_path = output_path
-    def run(self):
+    def __init__(self, net = None, reporters = (), **kwargs):
+        # A shared network is copied, since running uses up its energy
+        if net is not None:
+            self.net = net.copy()
+        else:
+            self.net = RandomAdHocNetwork(**kwargs)
+        self.reporters = list(reporters)
+        self.path_cache = PathCache()
+        self.beta = None
+
+    @property
+    def routing_net(self):
+        """
+        The network whose energy routing uses up
+        """
+        return self.net
+
+    def start(self):
+        """
+        Reset the routing state, ready for calls to route(). GDP routes on
+        self.net directly, so energy already used up stays used up.
+        """
+        self.satisfied_requests = []
+        self.request_solutions = []
+        self.beta = self.calculate_beta(self.net)
+        self.path_cache = PathCache()
+
+    def run(self, checkpoint=None, checkpoint_every=100):
+        """
+        Greedily route the remaining request with the lightest path until
+        none can be satisfied. With checkpoint, the state of the run is
+        saved to that path every checkpoint_every routed requests, for
+        resume().
+        """
+        results = Results("GDP", self.net.connected, self.reporters)
         if self.net.connected:
+            self.start()
             self.all_requests = list(self.net.requests)
             self.remaining_requests = list(self.net.requests)
-            self.satisfied_requests = []
-            self.request_solutions = []
-            total_energy = 0
-            net = self.net
-            self.beta = self.calculate_beta(net)
-            while self.remaining_requests:
-                net.prune_edges()
-                #request = self.remaining_requests.pop()
-                #src, dest = request
+            self._route_remaining(results, checkpoint, checkpoint_every)
+
+        results.finish()
+        return results
+
+    def resume(self, checkpoint, checkpoint_every=100):
+        """
+        Continue a run from a checkpoint that run() wrote for a network
+        with the same topology, checkpointing to it again as it goes.
+        Beta is worked out from the topology before the checkpoint is
+        loaded, as it was when the run started.
+        """
+        results = Results("GDP", self.net.connected, self.reporters)
+        if self.net.connected:
+            self.start()
+            checkpoints.restore(checkpoint, self, results)
+            self._route_remaining(results, checkpoint, checkpoint_every)
+
+        results.finish()
+        return results
+
+    def _route_remaining(self, results, checkpoint, checkpoint_every):
+        net = self.net
+        self.path_cache.invalidate(net.prune_edges())
+        heap, queued = self._candidates(net, self.remaining_requests)
+        while self.remaining_requests:
+            start = time.time()
+            min_request = None
+            instrumentation.begin_request("GDP")
+            try:
+                self.path_cache.invalidate(net.prune_edges())
 
                 try:
-                    min_request, min_path, min_path_value = self.minimum_weighted_path(net, self.remaining_requests)
+                    min_request, min_path, min_path_value = self._pop_minimum(net, heap, queued)
                 except NetworkXNoPath:
-                    print "Stopping, cannot satisfy any more requests"
+                    results.stop_reason = "Stopping, cannot satisfy any more requests"
                     break
 
-                min_energy = net.update_along_path(min_path)
-
                 self.remaining_requests.remove(min_request)
-                self.satisfied_requests.append(min_request)
-                self.request_solutions.append((min_request, min_path, min_energy))
-
-                self.multiply_weight_along_path(net, min_path)
-
-                total_energy += min_energy
-
-            if self.request_solutions:
-                print "Satisfied requests:"
-            for request, path, energy in self.request_solutions:
-                print
-                print "Request: {} -> {}".format(request[0], request[1])
-                if self.output_path is True:
-                    print "Path: {}".format(" -> ".join(path))
-                print "Energy Consumed: {}".format(energy)
-     
-            #self.net.raw(requests=self.satisfied_requests)
-            print
-            print "**************************************************************************************"
-            print "Total Requests Satisfied: {}".format(len(self.satisfied_requests))
-            print "Total Energy Consumed: {}".format(total_energy)
+                results.add(self._route_along(min_request, min_path, start))
+            finally:
+                instrumentation.end_request(min_request)
+            if checkpoint and len(results) % checkpoint_every == 0:
+                checkpoints.save(checkpoint, self, results)
+
+    def route(self, request, packets=1):
+        """
+        Route a single request as it arrives, on the weights and energy
+        left by the requests routed before it. Returns its RequestResult,
+        or raises NetworkXNoPath if it cannot be satisfied.
+
+        With packets above 1 the request is a flow, sent along one path
+        for as many packets as it can carry and routed again only when a
+        node on the path runs short; see flows.send().
+        """
+        instrumentation.begin_request("GDP")
+        try:
+            return self._route(request, packets)
+        finally:
+            instrumentation.end_request(request)
 
+    def _route(self, request, packets):
+        start = time.time()
+        if self.beta is None:
+            self.start()
+        segments = flows.send(self.net, lambda: self._find_path(request),
+                              packets, self._sent_along)
+
+        result = flows.request_result(request, segments, packets, start, self.net)
+        self.satisfied_requests.append(request)
+        self.request_solutions.append((request, result.path, result.energy))
+        return result
+
+    def _find_path(self, request):
+        self.path_cache.invalidate(self.net.prune_edges())
+        try:
+            request, path, path_value = self.minimum_weighted_path(self.net, [request])
+        except NetworkXNoPath:
+            raise NetworkXNoPath("Cannot satisfy request: {} -> {}".format(*request))
+        return path
+
+    def _sent_along(self, path, packets):
+        # Every packet sent multiplies the weights along its path by beta
+        self.path_cache.invalidate(
+            self.multiply_weight_along_path(self.net, path, packets))
+
+    def _route_along(self, request, path, start):
+        net = self.net
+        energy = net.update_along_path(path)
+
+        self.satisfied_requests.append(request)
+        self.request_solutions.append((request, path, energy))
+
+        self._sent_along(path, 1)
+
+        return RequestResult(request, path, energy, time.time() - start,
+                             net.depleted_nodes())
+
+    def _candidates(self, net, requests):
+        """
+        Min-heap of (path weight, position, request) for the requests
+        that can be satisfied, and the weight each position is queued at
+        """
+        self._find_paths(net, requests)
+        heap = []
+        queued = {}
+        for i, (src, dest) in enumerate(requests):
+            path, path_value = self.path_cache.get(src, dest, "weight")
+            if path is not None:
+                heap.append((path_value, i, (src, dest)))
+                queued[i] = path_value
+        heapify(heap)
+        return heap, queued
+
+    @instrumentation.timed("minimum_weighted_path")
+    def _pop_minimum(self, net, heap, queued):
+        """
+        Lazy greedy selection of the request with the lightest path.
+        Weights only grow and edges are only removed, so a queued weight
+        is a lower bound on the current one: the top candidate is the
+        minimum as soon as its cached path is still valid, and only
+        candidates that reach the top are searched again. Ties go to the
+        earliest request, as in minimum_weighted_path().
+        """
+        while heap:
+            value, i, request = heap[0]
+            if queued.get(i) != value:
+                # Requeued since at a newer weight
+                heappop(heap)
+                continue
+            src, dest = request
+            if self.path_cache.get(src, dest, "weight") is None:
+                self._find_paths(net, [request])
+            path, path_value = self.path_cache.get(src, dest, "weight")
+            if path is None:
+                heappop(heap)
+                del queued[i]
+            elif path_value == value:
+                heappop(heap)
+                del queued[i]
+                return request, path, path_value
+            else:
+                heapreplace(heap, (path_value, i, request))
+                queued[i] = path_value
+        raise NetworkXNoPath
+
+    def _find_paths(self, net, requests):
+        # Only requests whose cached path was invalidated are searched
+        # again, as one batch sharing a search per distinct source
+        cache = self.path_cache
+        queries = set(request for request in requests
+                      if cache.get(request[0], request[1], "weight") is None)
+        if not queries:
+            return
+        paths, lengths = net.shortest_paths(queries, weight="weight")
+        for src, dest in queries:
+            path = paths.get((src, dest))
+            if path is not None:
+                cache.put(src, dest, "weight", path, lengths[(src, dest)],
+                          net.path_edges(path))
+            else:
+                cache.put(src, dest, "weight", None, None)
+
+    @instrumentation.timed("minimum_weighted_path")
     def minimum_weighted_path(self, net, requests):
-        path = None
-        path_value = None
         min_path = None
         min_request = None
         min_path_value = None
+        cache = self.path_cache
+        self._find_paths(net, requests)
         for src, dest in requests:
-            try:
-                path = net.shortest_path(src, dest, weight="weight")
-                path_value = net.shortest_path_length(src, dest, weight="weight")
-            except NetworkXNoPath:
-                pass
+            path, path_value = cache.get(src, dest, "weight")
+            if path is None:
+                continue
             if min_path is None or path_value < min_path_value:
                 min_path = path
                 min_path_value = path_value
@@ -72,22 +233,30 @@ class GDP(object):
 
         return (min_request, min_path, min_path_value)
 
-    def multiply_weight_along_path(self, net, path):
-        for index, value in enumerate(path[:-1]):
-            net[path[index]][path[index+1]]["weight"] *= self.beta
+    @instrumentation.timed("multiply_weight_along_path")
+    def multiply_weight_along_path(self, net, path, packets=1):
+        # Returns the edges that became heavier. Internal edges weigh 0 and
+        # are left alone, and external weights overflow to infinity, as
+        # multiplying by beta once per packet would.
+        edges = net.path_edges(path)
+        instrumentation.count("weight_updates", len(edges))
+        edges = edges[net.external[edges]]
+        with np.errstate(over="ignore"):
+            net.edge_data["weight"][edges] *= np.power(self.beta, packets)
+        return edges
 
     def calculate_beta(self, net):
         epsilon = (net.min_energy + net.max_energy) / (float(2) * 1000000000)
-        m = len(net.edges())
+        m = net.number_of_edges()
         beta = m ** (float(1)/ (epsilon + 1) )
         return beta
 
-    def draw(self, output_file=None, requests=None):
+    def draw(self, output_file=None, requests=None, **kwargs):
         if self.net.connected:
             if requests is None:
                 requests = self.satisfied_requests
-            self.net.draw(output_file=output_file, requests=requests)
+            self.net.draw(output_file=output_file, requests=requests, **kwargs)
 
 if __name__ == "__main__":
-    gdp = GDP()
+    gdp = GDP(reporters=[PrintReporter()])
     gdp.run()
@@ -0,0 +1,186 @@
+"""
+Counters and an opt-in profiler for the routing hot paths.
+
+counters hold the total work done by every network in this process and
+are always kept. For a per-request breakdown, run an algorithm inside a
+Profiler:
+
+    with Profiler() as profiler:
+        OML(net=net).run()
+    profiler.write_table("profile.csv")
+    profiler.write_folded("profile.folded")
+
+The folded file is in the format flamegraph.pl and speedscope read. When
+no profiler is active, each instrumented call costs one check of active.
+"""
+from collections import defaultdict
+import csv
+import functools
+import time
+
+# Work done by every network in this process
+counters = {
+    "dijkstra_calls": 0,
+    "edges_touched": 0,
+}
+
+# The profiler instrumented code reports to, or None
+active = None
+
+
+def reset_counters():
+    for name in counters:
+        counters[name] = 0
+
+
+def timed(name):
+    """
+    Decorator recording each call of a function as a section called name
+    of the active profiler
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = active
+            if profiler is None:
+                return function(*args, **kwargs)
+            profiler.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.exit()
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    if active is not None:
+        active.current["counts"][name] += n
+
+
+def begin_request(algorithm):
+    if active is not None:
+        active.begin_request(algorithm)
+
+
+def end_request(request=None):
+    if active is not None:
+        active.end_request(request)
+
+
+class Profiler(object):
+    """
+    Times the sections of each request routed while it is active, along
+    with the edges Dijkstra and pruning touched in them. Work done outside
+    any request, such as copying the network when an algorithm starts, is
+    recorded in a "setup" row.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.folded = defaultdict(float)
+        self.stack = []
+        self.setup = self._row("setup")
+        self.current = self.setup
+        self.previous = None
+
+    def __enter__(self):
+        global active
+        self.previous = active
+        active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active = self.previous
+
+    @staticmethod
+    def _row(algorithm):
+        return {
+            "algorithm": algorithm,
+            "request": None,
+            "seconds": 0.0,
+            "started": time.time(),
+            "calls": defaultdict(int),
+            "section_seconds": defaultdict(float),
+            "edges_touched": defaultdict(int),
+            "counts": defaultdict(int),
+            "child_seconds": 0.0,
+        }
+
+    def begin_request(self, algorithm):
+        self.current = self._row(algorithm)
+
+    def end_request(self, request=None):
+        row = self.current
+        row["request"] = request
+        row["seconds"] = time.time() - row["started"]
+        self.folded[row["algorithm"]] += row["seconds"] - row["child_seconds"]
+        self.requests.append(row)
+        self.current = self.setup
+
+    def enter(self, name):
+        self.stack.append(
+            [name, time.time(), counters["edges_touched"], 0.0])
+
+    def exit(self):
+        name, started, touched, child_seconds = self.stack.pop()
+        elapsed = time.time() - started
+        row = self.current
+        row["calls"][name] += 1
+        row["section_seconds"][name] += elapsed
+        row["edges_touched"][name] += counters["edges_touched"] - touched
+        if self.stack:
+            self.stack[-1][3] += elapsed
+        else:
+            row["child_seconds"] += elapsed
+        frames = [row["algorithm"]] + [frame[0] for frame in self.stack]
+        frames.append(name)
+        self.folded[";".join(frames)] += elapsed - child_seconds
+
+    def table(self):
+        """
+        One dict per routed request, and one for setup if anything was
+        done outside requests, with the calls, seconds and edges touched
+        of each section and the counts recorded during it
+        """
+        rows = self.requests
+        if self.setup["calls"] or self.setup["counts"]:
+            rows = [self.setup] + rows
+        table = []
+        for row in rows:
+            record = {"algorithm": row["algorithm"], "seconds": row["seconds"]}
+            if row["request"] is not None:
+                record["src"], record["dest"] = row["request"]
+            for name in row["calls"]:
+                record[name + "_calls"] = row["calls"][name]
+                record[name + "_seconds"] = row["section_seconds"][name]
+                record[name + "_edges_touched"] = row["edges_touched"][name]
+            record.update(row["counts"])
+            table.append(record)
+        return table
+
+    def write_table(self, output_file):
+        """
+        Write table() as CSV, with empty cells for sections a request
+        did not enter
+        """
+        table = self.table()
+        first = ["algorithm", "src", "dest", "seconds"]
+        names = sorted(set(key for record in table for key in record) -
+                       set(first))
+        with open(output_file, "wb") as output:
+            writer = csv.DictWriter(output, first + names)
+            writer.writeheader()
+            writer.writerows(table)
+
+    def write_folded(self, output_file):
+        """
+        Write the self time of every stack of sections in microseconds,
+        one "frame;frame;frame count" line per stack
+        """
+        with open(output_file, "w") as output:
+            for stack in sorted(self.folded):
+                micros = int(round(self.folded[stack] * 1000000))
+                if micros > 0:
+                    output.write("{} {}\n".format(stack, micros))
@@ -1,69 +1,31 @@
 from networkx.exception import NetworkXNoPath
-from ad_hoc import RandomAdHocNetwork
+import numpy as np
+from path_routing import PathRouting
+from results import PrintReporter
 
-class MECBE(object):
-    def __init__(self, output_path = False, **kwargs):
-        self.net = RandomAdHocNetwork(**kwargs)
-        self.output_path = output_path
-    def run(self):
-        if self.net.connected:
-            self.all_requests = list(self.net.requests)
-            self.remaining_requests = list(self.net.requests)
-            self.satisfied_requests = []
-            self.request_solutions = []
-            total_energy = 0
-            net_prime = self.net.copy()
-            while self.remaining_requests:
-                net_prime.prune_edges()
-                request = self.remaining_requests.pop()
-                src, dest = request 
+class MECBE(PathRouting):
+    name = "MECBE"
 
-                try:
-                    minimum_path = self.minimum_metric_path(net_prime, src, dest)
-                except NetworkXNoPath:
-                    print "Stopping, cannot satisfy request: {} -> {}".format(src, dest)
-                    break
+    def _stop_reason(self, request, error):
+        return "Stopping, cannot satisfy request: {} -> {}".format(*request)
 
-                request_energy = net_prime.update_along_path(minimum_path)
+    def _find_path(self, net_prime, src, dest):
+        net_prime.prune_edges()
 
-                self.satisfied_requests.append((src, dest))
-                self.request_solutions.append(((src, dest), minimum_path, request_energy))
-
-                total_energy += request_energy
-
-            if self.request_solutions:
-                print "Satisfied requests:"
-            for request, path, energy in self.request_solutions:
-                print
-                if self.output_path is True:
-                    print "Path: {}".format(" -> ".join(path))
-                print "Request {} -> {}".format(request[0], request[1])
-                print "Energy Consumed: {}".format(energy)
-     
-            #self.net.draw(requests=self.satisfied_requests)
-            print
-            print "**************************************************************************************"
-            print "Total Requests Satisfied: {}".format(len(self.satisfied_requests))
-            print "Total Energy Consumed: {}".format(total_energy)
+        try:
+            return self.minimum_metric_path(net_prime, src, dest)
+        except NetworkXNoPath:
+            raise NetworkXNoPath("Cannot satisfy request: {} -> {}".format(src, dest))
 
     def minimum_metric_path(self, net, src, dest):
-        for edge in net.edges():
-            temp_src, temp_dest = edge
-            if net[temp_src][temp_dest]["type"] == "external":
-                net[temp_src][temp_dest]["metric"] = 1/net.node[temp_src]["energy"]
-            else:
-                net[temp_src][temp_dest]["metric"] = 0
+        # External edges weigh the reciprocal of their source's energy
+        with np.errstate(divide="ignore"):
+            metric = net.node_weight(1 / net.energy)
 
-        shortest_path = net.shortest_path(src, dest, weight="metric")
+        shortest_path = net.shortest_path(src, dest, weight=metric)
 
         return shortest_path
 
-    def draw(self, output_file=None, requests=None):
-        if self.net.connected:
-            if requests is None:
-                requests = self.satisfied_requests
-            self.net.draw(output_file=output_file, requests=requests)
-
 if __name__ == "__main__":
-    mecbe = MECBE()
+    mecbe = MECBE(reporters=[PrintReporter()])
     mecbe.run()
@@ -0,0 +1,137 @@
+"""
+Optimistic parallel routing for MECBE and OML.
+
+Requests are routed in batches. Each worker process routes its share of
+a batch against the network as it was when the batch started, recording
+the nodes its searches settled. The answers are then committed in the
+sequential order: a path is committed as found unless a path committed
+earlier in the batch charged a node its searches settled, in which case
+the request is routed again on the committed network.
+
+Edge weights and liveness only depend on the state of the node an edge
+leaves, and a search only looks at the edges of the nodes it settles, so
+a search that settled no charged node finds the path it would have found
+after the earlier requests of the batch. The results are therefore the
+same as routing the requests one at a time, for any number of workers.
+Requests far apart in the field rarely conflict.
+
+Workers keep their copy of the network in step by replaying the paths
+committed in each batch before routing the next one. Only the "python"
+backend settles nodes selectively, so it is the only one supported.
+"""
+from multiprocessing import Pipe, Process
+from networkx.exception import NetworkXNoPath
+import traceback
+
+import numpy as np
+
+import checkpoints
+import instrumentation
+
+
+def _settled(net):
+    # Nodes whose state the searches since net.reads was reset looked at
+    reads = np.fromiter(net.reads, dtype=np.int64, count=len(net.reads))
+    return np.unique(reads >> 1)
+
+
+def _worker(algorithm, connection):
+    net = algorithm.routing_net
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        paths, requests = message
+        try:
+            for path in paths:
+                net.prune_edges()
+                net.update_along_path(path)
+            answers = []
+            for src, dest in requests:
+                net.reads = set()
+                try:
+                    path = algorithm._find_path(net, src, dest)
+                    answers.append((path, None, _settled(net)))
+                except NetworkXNoPath as e:
+                    answers.append((None, str(e), _settled(net)))
+            net.reads = None
+        except Exception:
+            answers = traceback.format_exc()
+        connection.send(answers)
+
+
+def _found(net, path, error):
+    # Stands in for the algorithm's _find_path() with the answer found by
+    # a worker, pruning as it would have
+    def find_path():
+        net.prune_edges()
+        if path is None:
+            raise NetworkXNoPath(error)
+        return path
+    return find_path
+
+
+def route_remaining(algorithm, results, checkpoint, checkpoint_every,
+                    workers, batch_size=None):
+    """
+    Route algorithm.remaining_requests in batches of batch_size, by
+    default workers, until one cannot be satisfied, as the algorithm's
+    own _route_remaining() does. The latency of a request routed by a
+    worker only covers committing it.
+    """
+    net = algorithm.routing_net
+    if net.backend != "python":
+        raise ValueError("Parallel routing needs the python backend")
+    batch_size = batch_size or workers
+    connections = []
+    processes = []
+    for _ in xrange(workers):
+        connection, child = Pipe()
+        process = Process(target=_worker, args=(algorithm, child))
+        process.daemon = True
+        process.start()
+        connections.append(connection)
+        processes.append(process)
+
+    committed = []
+    charged = np.zeros(net.node_count, dtype=bool)
+    try:
+        while algorithm.remaining_requests:
+            batch = algorithm.remaining_requests[-batch_size:][::-1]
+            for i, connection in enumerate(connections):
+                connection.send((committed, batch[i::workers]))
+            answers = [None] * len(batch)
+            for i, connection in enumerate(connections):
+                reply = connection.recv()
+                if not isinstance(reply, list):
+                    raise RuntimeError("Routing worker failed:\n" + reply)
+                answers[i::workers] = reply
+
+            committed = []
+            charged[:] = False
+            for request, (path, error, settled) in zip(batch, answers):
+                algorithm.remaining_requests.pop()
+                find_path = None
+                if not charged[settled].any():
+                    find_path = _found(net, path, error)
+                instrumentation.begin_request(results.algorithm)
+                if find_path is None:
+                    instrumentation.count("parallel_conflicts")
+                try:
+                    result = algorithm._route(request, 1, find_path)
+                except NetworkXNoPath as e:
+                    results.stop_reason = algorithm._stop_reason(request, e)
+                    return
+                finally:
+                    instrumentation.end_request(request)
+                results.add(result)
+                committed.append(result.path)
+                edges = net.path_edges(result.path)
+                charged[net.src[edges[net.external[edges]]] >> 1] = True
+                if checkpoint and len(results) % checkpoint_every == 0:
+                    checkpoints.save(checkpoint, algorithm, results)
+    finally:
+        for connection in connections:
+            connection.send(None)
+        for process in processes:
+            process.join()
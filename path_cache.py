@@ -0,0 +1,47 @@
+class PathCache(object):
+    """
+    Shortest paths keyed by (src, dest, weight), together with the edges
+    each path uses.
+
+    The cache relies on edge weights never decreasing and edges only ever
+    being removed. A cached path whose edges are all unchanged is then
+    still a shortest path, since no other path can have become shorter,
+    so only paths through a changed edge need to be invalidated.
+    Unreachable pairs are cached as (None, None) and stay unreachable.
+    """
+
+    def __init__(self):
+        self.paths = {}
+        self.path_edges = {}
+        self.users = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get(self, src, dest, weight):
+        return self.paths.get((src, dest, weight))
+
+    def put(self, src, dest, weight, path, length, edges=()):
+        key = (src, dest, weight)
+        self._discard(key)
+        self.paths[key] = (path, length)
+        self.path_edges[key] = edges = [int(e) for e in edges]
+        for e in edges:
+            self.users.setdefault(e, set()).add(key)
+
+    def invalidate(self, edges):
+        """
+        Drop every cached path that uses one of edges, which have just
+        become heavier or been removed
+        """
+        for e in edges:
+            for key in list(self.users.get(int(e), ())):
+                self._discard(key)
+
+    def _discard(self, key):
+        self.paths.pop(key, None)
+        for e in self.path_edges.pop(key, ()):
+            users = self.users[e]
+            users.discard(key)
+            if not users:
+                del self.users[e]
@@ -0,0 +1,136 @@
+"""
+Routing by searching one path per request on a copy of the network, as
+OML and MECBE do. Subclasses set name and define _find_path(net_prime,
+src, dest), which prunes net_prime and returns the path to charge or
+raises NetworkXNoPath.
+"""
+from networkx.exception import NetworkXNoPath
+import time
+import checkpoints
+import flows
+import instrumentation
+import parallel
+from ad_hoc import RandomAdHocNetwork
+from results import Results
+
+class PathRouting(object):
+    name = None
+
+    def __init__(self, net = None, reporters = (), **kwargs):
+        # A shared network is copied, since running uses up its energy
+        if net is not None:
+            self.net = net.copy()
+        else:
+            self.net = RandomAdHocNetwork(**kwargs)
+        self.reporters = list(reporters)
+        self.net_prime = None
+
+    @property
+    def routing_net(self):
+        """
+        The network whose energy routing uses up
+        """
+        if self.net_prime is None:
+            self.start()
+        return self.net_prime
+
+    def start(self):
+        """
+        Reset the routing state, ready for calls to route()
+        """
+        self.satisfied_requests = []
+        self.request_solutions = []
+        self.net_prime = self.net.copy()
+
+    def run(self, checkpoint=None, checkpoint_every=100, workers=1):
+        """
+        Route the network's requests until one cannot be satisfied. With
+        checkpoint, the state of the run is saved to that path every
+        checkpoint_every routed requests, for resume(). With workers above
+        1, that many processes route requests at once, with the same
+        results; see parallel.py.
+        """
+        results = Results(self.name, self.net.connected, self.reporters)
+        if self.net.connected:
+            self.start()
+            self.all_requests = list(self.net.requests)
+            self.remaining_requests = list(self.net.requests)
+            self._route_remaining(results, checkpoint, checkpoint_every,
+                                  workers)
+
+        results.finish()
+        return results
+
+    def resume(self, checkpoint, checkpoint_every=100, workers=1):
+        """
+        Continue a run from a checkpoint that run() wrote for a network
+        with the same topology, checkpointing to it again as it goes
+        """
+        results = Results(self.name, self.net.connected, self.reporters)
+        if self.net.connected:
+            self.start()
+            checkpoints.restore(checkpoint, self, results)
+            self._route_remaining(results, checkpoint, checkpoint_every,
+                                  workers)
+
+        results.finish()
+        return results
+
+    def _route_remaining(self, results, checkpoint, checkpoint_every,
+                         workers=1):
+        if workers > 1:
+            parallel.route_remaining(self, results, checkpoint,
+                                     checkpoint_every, workers)
+            return
+        while self.remaining_requests:
+            request = self.remaining_requests.pop()
+            try:
+                results.add(self.route(request))
+            except NetworkXNoPath as e:
+                results.stop_reason = self._stop_reason(request, e)
+                break
+            if checkpoint and len(results) % checkpoint_every == 0:
+                checkpoints.save(checkpoint, self, results)
+
+    def _stop_reason(self, request, error):
+        # Why a run stopped at request, which _find_path() raised error for
+        return str(error)
+
+    def route(self, request, packets=1):
+        """
+        Route a single request on the energy left by the requests routed
+        before it. Returns its RequestResult, or raises NetworkXNoPath if
+        it cannot be satisfied.
+
+        With packets above 1 the request is a flow, sent along one path
+        for as many packets as it can carry and routed again only when a
+        node on the path runs short; see flows.send().
+        """
+        instrumentation.begin_request(self.name)
+        try:
+            return self._route(request, packets)
+        finally:
+            instrumentation.end_request(request)
+
+    def _route(self, request, packets, find_path=None):
+        # find_path, if given, replaces searching for the path
+        start = time.time()
+        src, dest = request
+        net_prime = self.routing_net
+        if find_path is None:
+            find_path = lambda: self._find_path(net_prime, src, dest)
+        segments = flows.send(net_prime, find_path, packets)
+
+        result = flows.request_result((src, dest), segments, packets, start, net_prime)
+        self.satisfied_requests.append((src, dest))
+        self.request_solutions.append(((src, dest), result.path, result.energy))
+        return result
+
+    def _find_path(self, net_prime, src, dest):
+        raise NotImplementedError
+
+    def draw(self, output_file=None, requests=None, **kwargs):
+        if self.net.connected:
+            if requests is None:
+                requests = self.satisfied_requests
+            self.net.draw(output_file=output_file, requests=requests, **kwargs)
@@ -0,0 +1,155 @@
+import json
+
+
+class RequestResult(object):
+    """
+    Outcome of routing a single request: the path taken, the energy it
+    consumed, how long routing took in seconds, and how many nodes were
+    depleted afterwards.
+
+    For a flow of several packets, packets is how many were delivered and
+    segments lists the (path, packets, energy) of each path the flow was
+    sent along in turn; path is then the first of them and energy the
+    total.
+    """
+
+    def __init__(self, request, path, energy, latency, depleted_nodes,
+                 packets=1, segments=None):
+        self.request = request
+        self.path = path
+        self.energy = energy
+        self.latency = latency
+        self.depleted_nodes = depleted_nodes
+        self.packets = packets
+        self.segments = segments
+
+    def to_dict(self):
+        src, dest = self.request
+        record = {
+            "src": src,
+            "dest": dest,
+            "path": self.path,
+            "energy": self.energy,
+            "latency": self.latency,
+            "depleted_nodes": self.depleted_nodes,
+            "packets": self.packets,
+        }
+        if self.segments is not None:
+            record["segments"] = [
+                {"path": path, "packets": packets, "energy": energy}
+                for path, packets, energy in self.segments]
+        return record
+
+    @classmethod
+    def from_dict(cls, record):
+        request = (str(record["src"]), str(record["dest"]))
+        path = [str(node) for node in record["path"]]
+        segments = record.get("segments")
+        if segments is not None:
+            segments = [([str(node) for node in segment["path"]],
+                         segment["packets"], segment["energy"])
+                        for segment in segments]
+        return cls(request, path, record["energy"], record["latency"],
+                   record["depleted_nodes"], record.get("packets", 1),
+                   segments)
+
+
+class Results(object):
+    """
+    Outcome of a run of one algorithm. Routed requests are passed on to
+    each reporter as they are added, and finish() is passed on once the
+    run is over.
+    """
+
+    def __init__(self, algorithm, connected=True, reporters=()):
+        self.algorithm = algorithm
+        self.connected = connected
+        self.reporters = list(reporters)
+        self.requests = []
+        self.stop_reason = None
+
+    def __iter__(self):
+        return iter(self.requests)
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, result):
+        self.requests.append(result)
+        for reporter in self.reporters:
+            reporter.report(self, result)
+
+    def finish(self):
+        for reporter in self.reporters:
+            reporter.finish(self)
+
+    @property
+    def satisfied_requests(self):
+        return [result.request for result in self.requests]
+
+    @property
+    def total_energy(self):
+        return sum(result.energy for result in self.requests)
+
+    @property
+    def depleted_nodes(self):
+        if self.requests:
+            return self.requests[-1].depleted_nodes
+        return 0
+
+
+class JSONLWriter(object):
+    """
+    Reporter that appends one JSON record per routed request to
+    output_file, a path or an open file, as soon as it is routed
+    """
+
+    def __init__(self, output_file):
+        if hasattr(output_file, "write"):
+            self.output = output_file
+            self.owned = False
+        else:
+            self.output = open(output_file, "a")
+            self.owned = True
+
+    def report(self, results, result):
+        record = result.to_dict()
+        record["algorithm"] = results.algorithm
+        self.output.write(json.dumps(record, sort_keys=True) + "\n")
+        self.output.flush()
+
+    def finish(self, results):
+        if self.owned:
+            self.output.close()
+
+
+class PrintReporter(object):
+    """
+    Reporter that prints the satisfied requests and totals once a run is
+    over, optionally with the path of each request
+    """
+
+    def __init__(self, output_path=False):
+        self.output_path = output_path
+
+    def report(self, results, result):
+        pass
+
+    def finish(self, results):
+        if not results.connected:
+            return
+        if results.stop_reason:
+            print results.stop_reason
+        if results.requests:
+            print "Satisfied requests:"
+        for result in results:
+            print
+            print "Request: {} -> {}".format(result.request[0], result.request[1])
+            if self.output_path is True:
+                print "Path: {}".format(" -> ".join(result.path))
+            print "Energy Consumed: {}".format(result.energy)
+
+        print
+        print "**************************************************************************************"
+        print "Total Requests Satisfied: {}".format(len(results))
+        print "Total Energy Consumed: {}".format(results.total_energy)
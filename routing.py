@@ -0,0 +1,118 @@
+"""
+Shortest path searches over the CSR edge arrays of a split-node network.
+
+Weights and edge filters are given either as arrays over all edges or as
+functions from a slice of the edges leaving one node to their values.
+Functions with a true "vectorized" attribute may also be called with
+every edge at once.
+
+dijkstra() is a pure Python search that only evaluates weight and filter
+functions for the nodes it settles, and stops once its targets are
+settled. csgraph_dijkstra() answers a batch of sources with one call into
+scipy.sparse.csgraph once every edge has been evaluated, when scipy is
+installed.
+"""
+from heapq import heappush, heappop
+from itertools import count
+
+import numpy as np
+
+import instrumentation
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra as _csgraph_dijkstra
+except ImportError:
+    csr_matrix = None
+
+# Predecessor of a source or unreachable node in csgraph_dijkstra()
+NO_PREDECESSOR = -9999
+
+
+def dijkstra(indptr, dst, source, targets, weights, live, order=None):
+    """
+    Dijkstra's algorithm from source over the edges live allows, stopping
+    once every node in targets is settled. Returns the settled distances
+    and the predecessors of reached nodes, as dicts by node index.
+
+    Equally short paths are tied by the order nodes are reached in. The
+    edges of a node are expanded in CSR order, or if order is given, in
+    the order of their positions order[edges] within the node's edges.
+    """
+    weight_of = weights if callable(weights) else weights.__getitem__
+    live_of = live if callable(live) else live.__getitem__
+    dist = {}
+    seen = {source: 0}
+    pred = {source: None}
+    c = count()
+    fringe = [(0, next(c), source)]
+    remaining = set(targets)
+    touched = 0
+    while fringe:
+        d, _, v = heappop(fringe)
+        if v in dist:
+            continue
+        dist[v] = d
+        remaining.discard(v)
+        if not remaining:
+            break
+        edges = slice(indptr[v], indptr[v + 1])
+        mask = live_of(edges)
+        touched += len(mask)
+        if not mask.any():
+            continue
+        expanded = zip(dst[edges].tolist(), weight_of(edges).tolist(),
+                       mask.tolist())
+        if order is not None:
+            expanded = [expanded[i] for i in order[edges].tolist()]
+        for u, w, usable in expanded:
+            if not usable or u in dist:
+                continue
+            vu_dist = d + w
+            if u not in seen or vu_dist < seen[u]:
+                seen[u] = vu_dist
+                pred[u] = v
+                heappush(fringe, (vu_dist, next(c), u))
+    instrumentation.counters["dijkstra_calls"] += 1
+    instrumentation.counters["edges_touched"] += touched
+    return dist, pred
+
+
+def _evaluate(function, indptr, nodes):
+    # Values of a per-node edge function for every edge, calling it once
+    # per node in nodes and leaving the edges of other nodes at zero
+    if not callable(function):
+        return function
+    if getattr(function, "vectorized", False):
+        return function(slice(0, indptr[-1]))
+    values = np.zeros(indptr[-1])
+    for v in nodes:
+        edges = slice(indptr[v], indptr[v + 1])
+        values[edges] = function(edges)
+    return values
+
+
+def csgraph_dijkstra(indptr, dst, sources, weights, live):
+    """
+    Distances and predecessors from each of sources to every node, as
+    arrays with one row per source. Unreachable nodes are at infinity,
+    and NO_PREDECESSOR marks sources and unreachable nodes.
+
+    Weight functions are only evaluated for nodes with a live edge, which
+    keeps functions that reduce over a node's live edges well defined.
+    """
+    if csr_matrix is None:
+        raise ImportError("scipy is needed for the csgraph backend")
+    node_count = len(indptr) - 1
+    mask = _evaluate(live, indptr, xrange(node_count)).astype(bool)
+    # Filtering the CSR arrays directly keeps zero-weight edges, such as
+    # the internal "n in" -> "n out" edges, as explicit entries
+    kept = np.concatenate(([0], np.cumsum(mask)))[indptr]
+    has_live = np.flatnonzero(np.diff(kept)).tolist()
+    weight_values = _evaluate(weights, indptr, has_live)
+    graph = csr_matrix((np.asarray(weight_values, dtype=float)[mask],
+                        dst[mask], kept), shape=(node_count, node_count))
+    instrumentation.counters["dijkstra_calls"] += len(sources)
+    instrumentation.counters["edges_touched"] += len(mask) * len(sources)
+    return _csgraph_dijkstra(graph, indices=sources,
+                             return_predecessors=True)
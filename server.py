@@ -0,0 +1,298 @@
+"""
+Route-decision service: holds one network and one algorithm in memory
+and answers JSONL route requests on stdin/stdout or a Unix socket.
+
+A request is {"id": ..., "src": ..., "dest": ..., "packets": 1}, with
+nodes given as numbers or "n in" names, and is answered with the path
+and the energy charged for it, or with an "error". {"stats": true} is
+answered with latency percentiles and queue depths, the number of
+requests read in one pass over the connections.
+
+Requests are routed as soon as they are read, in the order they arrive.
+Gathering them for a tick to search their paths in one batch does not
+pay: OML and MECBE search each path on the energy the path before it
+left, and each GDP path reweights its edges, so a path searched for a
+later request in the batch is mostly stale by the time it is routed.
+
+Python 2 has no asyncio, so the event loop is a single-threaded select()
+loop; routing is serialised through it, as it must be on shared state.
+Answers are buffered per connection and written as the client reads
+them, so a client that stops reading only holds up itself: once its
+unwritten answers pass max_output, its requests are no longer read.
+"""
+from collections import deque
+from networkx.exception import NetworkXNoPath
+import argparse
+import errno
+import fcntl
+import json
+import os
+import select
+import socket
+import sys
+import time
+
+from ad_hoc import RandomAdHocNetwork
+from algorithms import ALGORITHMS
+from sweep import Quiet, network_kwargs
+
+
+def _node(value):
+    if isinstance(value, (int, long)):
+        return "{} in".format(value)
+    return str(value)
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(percentile / 100.0 * (len(values) - 1)))]
+
+
+class _Stream(object):
+    """
+    JSONL connection over a file descriptor to read from and one to
+    write to, which are the same for a socket. Writes do not block:
+    records sent are kept in output until write() gets them out.
+    """
+
+    def __init__(self, read_fd, write_fd, sock=None):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.sock = sock
+        self.buffer = ""
+        self.output = ""
+        self.reading = True
+        self.closed = False
+        flags = fcntl.fcntl(write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self.read_fd
+
+    def read(self):
+        """
+        Records from the complete lines now available, or None once the
+        other end has closed
+        """
+        try:
+            data = os.read(self.read_fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            data = ""
+        if not data:
+            if not self.buffer.strip():
+                return None
+            # A last line without a newline, then None on the next read
+            lines = [self.buffer]
+            self.buffer = ""
+        else:
+            lines = (self.buffer + data).split("\n")
+            self.buffer = lines.pop()
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                records.append({"error": "Invalid JSON: {}".format(e)})
+        return records
+
+    def send(self, record):
+        if not self.closed:
+            self.output += json.dumps(record, sort_keys=True) + "\n"
+
+    def write(self):
+        """
+        Write as much of output as the other end takes without blocking
+        """
+        while self.output:
+            try:
+                written = os.write(self.write_fd, self.output[:65536])
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # The client has gone away
+                self.output = ""
+                self.reading = False
+                self.closed = True
+                return
+            self.output = self.output[written:]
+
+    def close(self):
+        self.closed = True
+        if self.sock is not None:
+            self.sock.close()
+
+
+class RouteServer(object):
+    """
+    Queue the route requests read together and answer them in order.
+    latencies holds the time from receiving to answering the most recent
+    requests, and queue_depths how many were read together in the most
+    recent passes over the connections.
+    """
+
+    def __init__(self, algorithm, history=10000, max_output=1 << 20):
+        self.algorithm = algorithm
+        self.max_output = max_output
+        self.queue = []
+        self.latencies = deque(maxlen=history)
+        self.queue_depths = deque(maxlen=history)
+        self.routed = 0
+        self.dropped = 0
+        algorithm.start()
+
+    def submit(self, record, reply):
+        self.queue.append((time.time(), record, reply))
+
+    def flush(self):
+        batch = self.queue
+        self.queue = []
+        if not batch:
+            return
+        self.queue_depths.append(len(batch))
+        for received, record, reply in batch:
+            request, value = self.parse(record)
+            if request is None:
+                response = value if value is not None else self.stats()
+            else:
+                response = self.route(request, value)
+            if isinstance(record, dict) and "id" in record:
+                response["id"] = record["id"]
+            latency = time.time() - received
+            if "path" in response:
+                response["latency"] = latency
+                self.latencies.append(latency)
+            reply(response)
+
+    def parse(self, record):
+        """
+        (request, packets) for a valid route request, (None, None) for a
+        stats request, or (None, response) for anything else
+        """
+        if not isinstance(record, dict):
+            return None, {"error": "Invalid request: not a JSON object"}
+        if "error" in record:
+            return None, {"error": record["error"]}
+        if record.get("stats"):
+            return None, None
+        try:
+            request = (_node(record["src"]), _node(record["dest"]))
+            packets = int(record.get("packets", 1))
+        except (KeyError, TypeError, ValueError) as e:
+            return None, {"error": "Invalid request: {}".format(e)}
+        index = self.algorithm.net.index
+        if request[0] not in index or request[1] not in index:
+            return None, {"error": "Unknown node in request: {} -> {}".format(*request)}
+        if index[request[0]] >> 1 == index[request[1]] >> 1:
+            return None, {"error": "Source and destination are the same node: {} -> {}".format(*request)}
+        if packets < 1:
+            return None, {"error": "Invalid request: packets must be at least 1"}
+        return request, packets
+
+    def route(self, request, packets):
+        try:
+            result = self.algorithm.route(request, packets)
+        except NetworkXNoPath as e:
+            self.dropped += 1
+            return {"error": str(e) or "Cannot satisfy request: {} -> {}".format(*request)}
+        except Exception as e:
+            # A failing request must not take the service down
+            self.dropped += 1
+            return {"error": "Failed to route request {} -> {}: {!r}".format(
+                request[0], request[1], e)}
+        self.routed += 1
+        response = result.to_dict()
+        del response["latency"]
+        return response
+
+    def stats(self):
+        latencies = list(self.latencies)
+        return {
+            "routed": self.routed,
+            "dropped": self.dropped,
+            "last_queue_depth": self.queue_depths[-1] if self.queue_depths else 0,
+            "max_queue_depth": max(self.queue_depths) if self.queue_depths else 0,
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+            "latency_p99": _percentile(latencies, 99),
+            "depleted_nodes": self.algorithm.routing_net.depleted_nodes(),
+        }
+
+    def serve(self, streams=(), listener=None):
+        """
+        Answer requests from streams, and from every connection accepted
+        on listener, until all streams are closed and there is no
+        listener
+        """
+        streams = list(streams)
+        while streams or listener is not None:
+            reading = [stream for stream in streams if stream.reading and
+                       len(stream.output) < self.max_output]
+            if listener is not None:
+                reading.append(listener)
+            writing = [stream.write_fd for stream in streams if stream.output]
+            readable, writable, _ = select.select(reading, writing, [])
+            for stream in streams:
+                if stream.write_fd in writable:
+                    stream.write()
+            for stream in readable:
+                if stream is listener:
+                    connection, _ = listener.accept()
+                    streams.append(_Stream(connection.fileno(),
+                                           connection.fileno(), connection))
+                    continue
+                records = stream.read()
+                if records is None:
+                    # Still answer what the client sent before closing its
+                    # end, since it may be reading
+                    stream.reading = False
+                    continue
+                for record in records:
+                    self.submit(record, stream.send)
+            self.flush()
+            for stream in list(streams):
+                if not stream.reading and not stream.output:
+                    streams.remove(stream)
+                    stream.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Answer JSONL route requests on stdin/stdout or a Unix socket")
+    parser.add_argument("--algorithm", choices=[name for name, _ in ALGORITHMS],
+                        default="OML")
+    parser.add_argument("--socket", help="Unix socket path to listen on")
+    parser.add_argument("--load", help="Network directory written by save()")
+    parser.add_argument("--node-count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.load:
+        net = RandomAdHocNetwork.load(args.load)
+    else:
+        config = {"node_count": args.node_count, "max_attempts": 100}
+        with Quiet():
+            net = RandomAdHocNetwork(**network_kwargs(config, args.seed))
+    if not net.connected:
+        sys.stderr.write("Error: graph is not connected\n")
+        sys.exit(1)
+
+    server = RouteServer(dict(ALGORITHMS)[args.algorithm](net=net))
+    if args.socket:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        listener.bind(args.socket)
+        listener.listen(16)
+        try:
+            server.serve(listener=listener)
+        finally:
+            listener.close()
+            os.remove(args.socket)
+    else:
+        server.serve([_Stream(sys.stdin.fileno(), sys.stdout.fileno())])
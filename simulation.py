@@ -0,0 +1,170 @@
+from networkx.exception import NetworkXNoPath
+import json
+import random
+import time
+
+
+def _request(src, dest):
+    return ("{} in".format(src), "{} in".format(dest))
+
+
+def poisson_requests(node_count, rate=1.0, seed=None):
+    """
+    Endless stream of (arrival_time, request) pairs between uniformly
+    chosen nodes, arriving as a Poisson process with the given rate
+    """
+    rng = random.Random(seed)
+    arrival = 0.0
+    while True:
+        arrival += rng.expovariate(rate)
+        src, dest = rng.sample(xrange(node_count), 2)
+        yield arrival, _request(src, dest)
+
+
+def hotspot_requests(node_count, rate=1.0, hotspots=5, skew=0.8, seed=None):
+    """
+    Like poisson_requests, but with probability skew a request goes to one
+    of a few hotspot nodes, as traffic towards sinks or gateways does
+    """
+    rng = random.Random(seed)
+    hotspot_nodes = rng.sample(xrange(node_count), hotspots)
+    arrival = 0.0
+    while True:
+        arrival += rng.expovariate(rate)
+        if rng.random() < skew:
+            dest = rng.choice(hotspot_nodes)
+            src = rng.randrange(node_count - 1)
+            if src >= dest:
+                src += 1
+        else:
+            src, dest = rng.sample(xrange(node_count), 2)
+        yield arrival, _request(src, dest)
+
+
+def trace_requests(trace_file, rate=1.0):
+    """
+    Replay the requests in a JSONL trace, such as JSONLWriter writes.
+    Records with a "time" field arrive then, and others arrive 1 / rate
+    after the previous request.
+    """
+    arrival = 0.0
+    with open(trace_file) as trace:
+        for line in trace:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            arrival = record.get("time", arrival + 1.0 / rate)
+            yield arrival, (str(record["src"]), str(record["dest"]))
+
+
+class SimulationReport(object):
+    """
+    Throughput, routing latency and network lifetime of a simulation.
+    Lifetimes are given as the arrival time and the number of the request
+    after which the first and the k-th node were depleted, or None if
+    that never happened.
+    """
+
+    def __init__(self, algorithm, k):
+        self.algorithm = algorithm
+        self.k = k
+        self.routed = 0
+        self.dropped = 0
+        self.packets = 0
+        self.routing_time = 0.0
+        self.latencies = []
+        self.first_depleted = None
+        self.kth_depleted = None
+        self.end_time = 0.0
+
+    @property
+    def throughput(self):
+        """
+        Requests routed per second of time spent routing
+        """
+        if self.routing_time == 0:
+            return 0.0
+        return self.routed / self.routing_time
+
+    def latency_percentile(self, percentile):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
+    def to_dict(self):
+        return {
+            "algorithm": self.algorithm,
+            "k": self.k,
+            "routed": self.routed,
+            "dropped": self.dropped,
+            "packets": self.packets,
+            "throughput": self.throughput,
+            "latency_p50": self.latency_percentile(50),
+            "latency_p95": self.latency_percentile(95),
+            "latency_max": self.latency_percentile(100),
+            "first_depleted": self.first_depleted,
+            "kth_depleted": self.kth_depleted,
+            "end_time": self.end_time,
+        }
+
+
+class Simulation(object):
+    """
+    Feed a stream of (arrival_time, request) pairs to an algorithm's
+    route() one request at a time. Requests that cannot be routed are
+    dropped rather than ending the simulation.
+
+    With idle_power set, every node also uses up that much energy per
+    unit of simulated time between arrivals. With packets above 1, every
+    request is a flow of that many packets; see flows.send().
+    """
+
+    def __init__(self, algorithm, stream, k=1, idle_power=0, packets=1):
+        self.algorithm = algorithm
+        self.stream = stream
+        self.k = k
+        self.idle_power = idle_power
+        self.packets = packets
+
+    def run(self, max_requests=None, until=None):
+        """
+        Route requests until the stream ends, max_requests have arrived or
+        the arrival time passes until, and return a SimulationReport
+        """
+        algorithm = self.algorithm
+        report = SimulationReport(type(algorithm).__name__, self.k)
+        if not algorithm.net.connected:
+            return report
+        algorithm.start()
+        now = 0.0
+        for count, (arrival, request) in enumerate(self.stream):
+            if max_requests is not None and count >= max_requests:
+                break
+            if until is not None and arrival > until:
+                break
+            if self.idle_power:
+                algorithm.routing_net.drain(self.idle_power * (arrival - now))
+            now = arrival
+
+            start = time.time()
+            try:
+                result = algorithm.route(request, self.packets)
+            except NetworkXNoPath:
+                result = None
+            elapsed = time.time() - start
+            report.routing_time += elapsed
+            report.latencies.append(elapsed)
+
+            if result is None:
+                report.dropped += 1
+                continue
+            report.routed += 1
+            report.packets += result.packets
+            if report.first_depleted is None and result.depleted_nodes >= 1:
+                report.first_depleted = (arrival, count + 1)
+            if report.kth_depleted is None and result.depleted_nodes >= self.k:
+                report.kth_depleted = (arrival, count + 1)
+        report.end_time = now
+        return report
@@ -0,0 +1,145 @@
+from itertools import product
+from multiprocessing import Pool, cpu_count
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ad_hoc import RandomAdHocNetwork
+from algorithms import ALGORITHMS
+
+# Energy is in joules and packet size in bytes, as in all.py
+defaults = {
+    "node_count": 100,
+    "width": 1000,
+    "height": 1000,
+    "transmission_range": 200,
+    "energy": 0.04,
+    "packet_size": 512,
+    "number_of_requests": 20,
+    # Draw disconnected topologies again up to this many times
+    "max_attempts": 1,
+}
+
+
+def config_grid(**axes):
+    """
+    Every combination of the given parameter values, e.g.
+    config_grid(node_count=[100, 200], number_of_requests=[20, 40])
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values))
+            for values in product(*[axes[name] for name in names])]
+
+
+def network_kwargs(config, seed):
+    kwargs = dict(defaults)
+    kwargs.update(config)
+    # Convert joules to nanojoules and bytes to bits
+    energy = kwargs.pop("energy")
+    kwargs["min_energy"] = energy * 1000000000
+    kwargs["max_energy"] = energy * 1000000000
+    kwargs["packet_size"] *= 8
+    kwargs["seed"] = seed
+    return kwargs
+
+
+class Quiet(object):
+    """
+    Discard everything printed to stdout, such as the warning printed
+    for disconnected topologies
+    """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def build_topology(task):
+    """
+    Build the topology for one (config, seed) cell and save it to path
+    """
+    config, seed, path = task
+    with Quiet():
+        net = RandomAdHocNetwork(**network_kwargs(config, seed))
+    net.save(path)
+    return path
+
+
+def run_cell(cell):
+    """
+    Run one algorithm on the saved topology of a (config, seed) cell and
+    return its result record. The topology is memory-mapped, so cells
+    sharing it do not each hold a copy.
+    """
+    name, config, seed, path = cell
+    net = RandomAdHocNetwork.load(path)
+    instance = dict(ALGORITHMS)[name](net=net)
+    start = time.time()
+    results = instance.run()
+    seconds = time.time() - start
+    # Every parameter of the run, with defaults for those off the grid
+    record = dict(defaults)
+    record.update(config)
+    record.update({
+        "algorithm": name,
+        "seed": seed,
+        "connected": net.connected,
+        "attempts": net.attempts,
+        "satisfied_requests": len(results),
+        "total_energy": results.total_energy,
+        "depleted_nodes": instance.net.depleted_nodes(),
+        "seconds": seconds,
+    })
+    return record
+
+
+def sweep(configs, seeds, output_file, processes=None):
+    """
+    Build the topology of every (config, seed) cell once, then run every
+    (algorithm, config, seed) cell against it in a process pool, writing
+    one JSON record per line to output_file as cells finish
+    """
+    topology_dir = tempfile.mkdtemp(prefix="sweep-")
+    tasks = [(config, seed, os.path.join(topology_dir, str(i)))
+             for i, (config, seed) in
+             enumerate(product(configs, seeds))]
+    cells = [(name, config, seed, path)
+             for config, seed, path in tasks for name, _ in ALGORITHMS]
+    pool = Pool(processes or cpu_count())
+    try:
+        pool.map(build_topology, tasks)
+        with open(output_file, "w") as output:
+            for record in pool.imap_unordered(run_cell, cells):
+                output.write(json.dumps(record, sort_keys=True) + "\n")
+                output.flush()
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(topology_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run OML, MECBE and GDP over a grid of configurations")
+    parser.add_argument("--output", default="sweep.jsonl")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--seeds", type=int, default=10)
+    parser.add_argument("--max-attempts", type=int, default=1)
+    args = parser.parse_args()
+
+    configs = config_grid(
+        node_count=[100],
+        number_of_requests=[20, 40, 60, 80, 100],
+        transmission_range=[200],
+        energy=[0.04],
+        max_attempts=[args.max_attempts],
+    )
+    sweep(configs, range(args.seeds), args.output, args.processes)
@@ -0,0 +1,109 @@
+"""
+Regression check that routing results stay those of the original
+networkx implementation, including when routing with several workers
+and when resuming from a checkpoint.
+
+Each entry is (satisfied requests, total energy, digest of the paths).
+Run with pytest, or directly with python.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from algorithms import ALGORITHMS
+from sweep import Quiet
+
+NETWORKX_RESULTS = {
+    ("OML", 0, 20): (20, 658742476.8, "f16836c717a8"),
+    ("OML", 0, 60): (56, 2265153536.0, "a14949c81721"),
+    ("OML", 1, 20): (20, 883397427.2, "3c237d90e18d"),
+    ("OML", 1, 60): (42, 1759337267.2, "0fbc5e559e89"),
+    ("OML", 2, 20): (20, 765275340.8, "0f7dd2412dc0"),
+    ("OML", 2, 60): (51, 2126485913.6, "2e6c49ade96a"),
+    ("OML", 3, 20): (20, 591687680.0, "a0a05416ea23"),
+    ("OML", 3, 60): (60, 1939613286.4, "c2bf202ede09"),
+    ("MECBE", 0, 20): (20, 886099148.8, "c9a11a99fbd3"),
+    ("MECBE", 0, 60): (44, 2209806336.0, "4d009af8f50d"),
+    ("MECBE", 1, 20): (20, 1121112883.2, "da4ed3a16278"),
+    ("MECBE", 1, 60): (31, 1537328332.8, "c87446111f68"),
+    ("MECBE", 2, 20): (20, 879924838.4, "cd15754920cc"),
+    ("MECBE", 2, 60): (34, 1655339008.0, "008cf54c7e59"),
+    ("MECBE", 3, 20): (20, 863169740.8, "72c9363c7ca9"),
+    ("MECBE", 3, 60): (29, 1339781120.0, "a6b5c32bcef2"),
+    ("GDP", 0, 20): (20, 646887833.6, "1a851c560fef"),
+    ("GDP", 0, 60): (58, 2406575718.4, "3d14e4659aeb"),
+    ("GDP", 1, 20): (20, 791142400.0, "3b0c80b0d69f"),
+    ("GDP", 1, 60): (51, 2062499430.4, "0ddcb157bb40"),
+    ("GDP", 2, 20): (20, 670429184.0, "73cfad80ab64"),
+    ("GDP", 2, 60): (52, 1887442944.0, "cb9f56deb716"),
+    ("GDP", 3, 20): (20, 567483596.8, "94abe33ebcd3"),
+    ("GDP", 3, 60): (59, 2059796889.6, "26a431e67368"),
+}
+
+
+def create(name, seed, number_of_requests):
+    with Quiet():
+        return dict(ALGORITHMS)[name](
+            node_count=100, width=1000, height=1000, transmission_range=200,
+            min_energy=0.04e9, max_energy=0.04e9, packet_size=4096,
+            number_of_requests=number_of_requests, seed=seed)
+
+
+def summary(algorithm):
+    solutions = algorithm.request_solutions
+    paths = json.dumps([path for _, path, _ in solutions])
+    return (len(solutions),
+            round(sum(energy for _, _, energy in solutions), 1),
+            hashlib.md5(paths).hexdigest()[:12])
+
+
+def route(name, seed, number_of_requests, **kwargs):
+    algorithm = create(name, seed, number_of_requests)
+    with Quiet():
+        algorithm.run(**kwargs)
+    return summary(algorithm)
+
+
+def resume(name, seed, number_of_requests, checkpoint_every=7):
+    # Route every request, then route again those after the last
+    # checkpoint, as if the run had been killed right after writing it
+    directory = tempfile.mkdtemp()
+    try:
+        checkpoint = os.path.join(directory, "checkpoint.npz")
+        route(name, seed, number_of_requests, checkpoint=checkpoint,
+              checkpoint_every=checkpoint_every)
+        algorithm = create(name, seed, number_of_requests)
+        with Quiet():
+            algorithm.resume(checkpoint, checkpoint_every)
+    finally:
+        shutil.rmtree(directory)
+    return summary(algorithm)
+
+
+def test_networkx_results():
+    for key in sorted(NETWORKX_RESULTS):
+        assert route(*key) == NETWORKX_RESULTS[key], key
+
+
+def test_parallel_results():
+    for name in ("OML", "MECBE"):
+        for seed in (0, 1, 2):
+            key = (name, seed, 60)
+            for workers in (2, 3):
+                assert route(*key, workers=workers) == NETWORKX_RESULTS[key], (key, workers)
+
+
+def test_resumed_results():
+    for name, _ in ALGORITHMS:
+        for seed in (0, 1, 2):
+            key = (name, seed, 60)
+            assert resume(*key) == NETWORKX_RESULTS[key], key
+
+
+if __name__ == "__main__":
+    test_networkx_results()
+    test_parallel_results()
+    test_resumed_results()
+    print "OK"
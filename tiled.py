@@ -0,0 +1,320 @@
+"""
+Generate very large random ad hoc networks straight to disk.
+
+The field is cut into square tiles at least the transmission range wide,
+and nodes are numbered tile by tile, so every neighbour of a node lies in
+a contiguous run of nodes in its own or an adjacent tile. Edges are found
+one tile at a time and appended to raw column files as NumPy arrays, so
+only the per-node arrays and one tile's edges are ever in memory. The
+result is the directory layout RandomAdHocNetwork.save() writes, which
+RandomAdHocNetwork.load() memory-maps.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+
+from ad_hoc import RandomAdHocNetwork
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+except ImportError:
+    csr_matrix = None
+
+# Nodes per tile on average, when the tile size is not given
+TILE_NODES = 256
+
+# Largest source x candidate distance block computed at once
+BLOCK_SIZE = 1 << 22
+
+# Edge columns written a tile at a time, with their dtypes
+EDGE_COLUMNS = [("src", np.int32), ("dst", np.int32), ("external", bool),
+                ("edge_keys", np.int64), ("edge_distance", float),
+                ("edge_cost", float), ("edge_weight", float)]
+COST_COLUMNS = [("by_cost", np.int64), ("sorted_cost", float)]
+
+
+def _random_coordinates(rng, node_count, width, height):
+    # Integer coordinates on [0, width] x [0, height], drawing duplicates
+    # again until every node has a position of its own
+    if node_count > (width + 1) * (height + 1):
+        raise ValueError("More nodes than positions in the field")
+    x = rng.randint(0, width + 1, node_count).astype(float)
+    y = rng.randint(0, height + 1, node_count).astype(float)
+    while True:
+        keys = x * (height + 1) + y
+        _, first = np.unique(keys, return_index=True)
+        if len(first) == node_count:
+            return x, y
+        duplicate = np.ones(node_count, dtype=bool)
+        duplicate[first] = False
+        count = np.count_nonzero(duplicate)
+        x[duplicate] = rng.randint(0, width + 1, count)
+        y[duplicate] = rng.randint(0, height + 1, count)
+
+
+def _components(path, node_count, edge_count):
+    # Number of connected components, from the edge columns on disk
+    indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")
+    dst = np.load(os.path.join(path, "dst.npy"), mmap_mode="r")
+    if csr_matrix is not None:
+        graph = csr_matrix((np.ones(edge_count, dtype=np.int8), dst, indptr),
+                           shape=(2 * node_count, 2 * node_count))
+        return connected_components(graph, connection="weak")[0]
+    parent = range(node_count)
+    components = node_count
+
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    src = np.load(os.path.join(path, "src.npy"), mmap_mode="r")
+    for lo in xrange(0, edge_count, BLOCK_SIZE):
+        for v, u in zip((src[lo:lo + BLOCK_SIZE] >> 1).tolist(),
+                        (dst[lo:lo + BLOCK_SIZE] >> 1).tolist()):
+            a, b = find(v), find(u)
+            if a != b:
+                parent[a] = b
+                components -= 1
+    return components
+
+
+def _to_npy(path, name, dtype, length):
+    # Turn a raw column file into a .npy file, copying it in chunks
+    raw = os.path.join(path, name + ".raw")
+    values = np.lib.format.open_memmap(os.path.join(path, name + ".npy"),
+                                       mode="w+", dtype=dtype,
+                                       shape=(length,))
+    if length:
+        source = np.memmap(raw, dtype=dtype, mode="r", shape=(length,))
+        for lo in xrange(0, length, BLOCK_SIZE):
+            values[lo:lo + BLOCK_SIZE] = source[lo:lo + BLOCK_SIZE]
+        del source
+    values.flush()
+    del values
+    os.remove(raw)
+
+
+def _tile_edges(x, y, sources, candidates, transmission_range):
+    """
+    The (source, neighbour) pairs within range of each other for the
+    given source and candidate node ranges, sorted by source then
+    neighbour, with their distances
+    """
+    lo, hi = sources
+    candidates = np.concatenate([np.arange(a, b) for a, b in candidates])
+    step = max(BLOCK_SIZE // max(len(candidates), 1), 1)
+    for start in xrange(lo, hi, step):
+        stop = min(start + step, hi)
+        dx = x[start:stop, None] - x[candidates]
+        dy = y[start:stop, None] - y[candidates]
+        distance = np.sqrt(dx * dx + dy * dy)
+        within = distance <= transmission_range
+        within &= candidates != np.arange(start, stop)[:, None]
+        rows, columns = np.nonzero(within)
+        yield start, stop, rows, candidates[columns], distance[rows, columns]
+
+
+def generate(path, node_count=100, width=1000, height=1000,
+             transmission_range=200, min_energy=5000000000,
+             max_energy=5000000000, packet_size=512, number_of_requests=10,
+             seed=None, tile_size=None):
+    """
+    Write a random network with the same parameters as RandomAdHocNetwork
+    to the directory path, for RandomAdHocNetwork.load(). Node positions
+    are drawn with NumPy from seed, so they differ from those of a
+    RandomAdHocNetwork built with the same seed. Returns the number of
+    edges written.
+    """
+    if tile_size is None:
+        tile_size = math.sqrt(TILE_NODES * float(width + 1) * (height + 1) /
+                              max(node_count, 1))
+    tile_size = max(tile_size, transmission_range, 1)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    rng = np.random.RandomState(seed)
+    x, y = _random_coordinates(rng, node_count, width, height)
+    energy = rng.uniform(min_energy, max_energy, node_count)
+
+    # Number the nodes tile by tile, row by row of tiles
+    columns = int(width // tile_size) + 1
+    rows = int(height // tile_size) + 1
+    tile = ((y // tile_size).astype(np.int64) * columns +
+            (x // tile_size).astype(np.int64))
+    order = np.argsort(tile, kind="mergesort")
+    x, y, energy, tile = x[order], y[order], energy[order], tile[order]
+    tile_indptr = np.searchsorted(tile, np.arange(rows * columns + 1))
+    del order, tile
+
+    files = dict((name, open(os.path.join(path, name + ".raw"), "wb"))
+                 for name, _ in EDGE_COLUMNS + COST_COLUMNS)
+    degree = np.zeros(node_count, dtype=np.int64)
+    edge_count = 0
+    try:
+        for row in xrange(rows):
+            for column in xrange(columns):
+                sources = (tile_indptr[row * columns + column],
+                           tile_indptr[row * columns + column + 1])
+                # Adjacent tiles of one row are numbered contiguously
+                lo = max(column - 1, 0)
+                hi = min(column + 2, columns)
+                candidates = [(tile_indptr[r * columns + lo],
+                               tile_indptr[r * columns + hi])
+                              for r in xrange(max(row - 1, 0),
+                                              min(row + 2, rows))]
+                for start, stop, sources_of, neighbours, distance in \
+                        _tile_edges(x, y, sources, candidates,
+                                    transmission_range):
+                    edge_count += _write_edges(
+                        files, node_count, edge_count, degree, start, stop,
+                        sources_of, neighbours, distance, packet_size)
+    finally:
+        for f in files.values():
+            f.close()
+
+    for name, dtype in EDGE_COLUMNS:
+        _to_npy(path, name, dtype, edge_count)
+    for name, dtype in COST_COLUMNS:
+        _to_npy(path, name, dtype, edge_count - node_count)
+
+    # Each node n has its internal edge from "n in" and degree[n]
+    # external edges from "n out"
+    counts = np.empty(2 * node_count, dtype=np.int64)
+    counts[0::2] = 1
+    counts[1::2] = degree
+    indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+    cost_indptr = np.concatenate(([0], np.cumsum(degree)))
+    np.save(os.path.join(path, "x.npy"), x)
+    np.save(os.path.join(path, "y.npy"), y)
+    np.save(os.path.join(path, "energy.npy"), energy)
+    np.save(os.path.join(path, "indptr.npy"), indptr)
+    np.save(os.path.join(path, "cost_indptr.npy"), cost_indptr)
+    np.save(os.path.join(path, "live_count.npy"), degree)
+    alive = np.lib.format.open_memmap(os.path.join(path, "alive.npy"),
+                                      mode="w+", dtype=bool,
+                                      shape=(edge_count,))
+    alive[:] = True
+    del alive
+
+    components = _components(path, node_count, edge_count)
+    src = rng.randint(0, node_count, number_of_requests)
+    dest = rng.randint(0, max(node_count - 1, 1), number_of_requests)
+    dest += dest >= src
+    info = {
+        "node_count": node_count,
+        "width": width,
+        "height": height,
+        "transmission_range": transmission_range,
+        "min_energy": min_energy,
+        "max_energy": max_energy,
+        "packet_size": packet_size,
+        "number_of_requests": number_of_requests,
+        "x_offset": width / 40,
+        "y_offset": height / 40,
+        "connected": components == 1,
+        "components": int(components),
+        "attempts": 1,
+        "requests": [("{} in".format(s), "{} in".format(d))
+                     for s, d in zip(src.tolist(), dest.tolist())],
+        "dirty": range(node_count),
+        "edge_data": ["cost", "distance", "weight"],
+    }
+    with open(os.path.join(path, "network.json"), "w") as f:
+        json.dump(info, f)
+    return edge_count
+
+
+def _write_edges(files, node_count, offset, degree, start, stop, rows,
+                 neighbours, distance, packet_size):
+    # Append the edges of nodes start to stop: each node's internal edge
+    # followed by its external edges in order of neighbour. Returns the
+    # number of edges written.
+    sources = stop - start
+    count = np.bincount(rows, minlength=sources)
+    degree[start:stop] = count
+    before = np.concatenate(([0], np.cumsum(count)[:-1]))
+    total = sources + len(rows)
+    internal = np.arange(sources) + before
+    external = np.arange(len(rows)) + rows + 1
+    nodes = np.arange(start, stop)
+
+    src = np.empty(total, dtype=np.int32)
+    dst = np.empty(total, dtype=np.int32)
+    is_external = np.zeros(total, dtype=bool)
+    edge_distance = np.zeros(total)
+    src[internal] = 2 * nodes
+    dst[internal] = 2 * nodes + 1
+    src[external] = 2 * (rows + start) + 1
+    dst[external] = 2 * neighbours
+    is_external[external] = True
+    edge_distance[external] = distance
+    k = packet_size
+    edge_cost = np.where(is_external, (50 * k) + (0.1 * k * edge_distance ** 2), 0)
+    edge_keys = src.astype(np.int64) * (2 * node_count) + dst
+
+    columns = {"src": src, "dst": dst, "external": is_external,
+               "edge_keys": edge_keys, "edge_distance": edge_distance,
+               "edge_cost": edge_cost, "edge_weight": edge_cost}
+    for name, _ in EDGE_COLUMNS:
+        columns[name].tofile(files[name])
+    # Sources are in order, so sorting within the block sorts globally
+    by_cost = external[np.lexsort((edge_cost[external], src[external]))]
+    (by_cost + offset).tofile(files["by_cost"])
+    edge_cost[by_cost].tofile(files["sorted_cost"])
+    return total
+
+
+if __name__ == "__main__":
+    from algorithms import ALGORITHMS
+    from benchmark import network_kwargs
+
+    parser = argparse.ArgumentParser(
+        description="Generate a large network on disk, then optionally "
+                    "route its requests")
+    parser.add_argument("path", help="Directory to write the network to")
+    parser.add_argument("--node-count", type=int, default=1000000)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tile-size", type=float)
+    parser.add_argument("--route", choices=[name for name, _ in ALGORITHMS],
+                        help="Route the requests with this algorithm")
+    parser.add_argument("--backend", choices=["python", "csgraph"],
+                        default="python",
+                        help="Shortest path search to route with")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes routing OML or MECBE requests at once")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the network directory once done")
+    args = parser.parse_args()
+
+    kwargs = network_kwargs(args.node_count, args.requests, args.seed)
+    start = time.time()
+    edges = generate(args.path, tile_size=args.tile_size, **kwargs)
+    print "Generated {} nodes and {} edges in {:.1f}s".format(
+        args.node_count, edges, time.time() - start)
+    try:
+        start = time.time()
+        net = RandomAdHocNetwork.load(args.path)
+        net.backend = args.backend
+        print "Loaded in {:.1f}s, {} components".format(
+            time.time() - start, net.components)
+        if args.route:
+            start = time.time()
+            algorithm = dict(ALGORITHMS)[args.route](net=net)
+            if args.workers > 1:
+                results = algorithm.run(workers=args.workers)
+            else:
+                results = algorithm.run()
+            print "{}: {} of {} requests routed in {:.1f}s".format(
+                args.route, len(results), len(net.requests),
+                time.time() - start)
+    finally:
+        if not args.keep:
+            shutil.rmtree(args.path)